@@ -0,0 +1,74 @@
+import time
+import typing as t
+import collections
+
+from app.models.metrics import CacheStats
+
+_K = t.TypeVar('_K', bound=t.Hashable)
+_V = t.TypeVar('_V')
+
+class TTLCache(t.Generic[_K, _V]):
+    '''
+    Bounded in-process cache with least-recently-used eviction and per-entry time to live.
+    Not thread safe, meant to be used from the event loop only.
+    '''
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        assert max_size > 0, 'Cache size must be positive'
+
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict[_K, tuple[float, _V]]()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: _K, default: _V | None = None) -> _V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self._hits += 1
+
+        return value
+
+    def set(self, key: _K, value: _V, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self._ttl if ttl is None else ttl)
+
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: _K) -> None:
+        self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: t.Callable[[_K, _V], bool]) -> None:
+        stale_keys = [
+            key
+            for key, (_, value)
+            in self._entries.items()
+            if predicate(key, value)]
+        for key in stale_keys:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def get_stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            size=len(self._entries),
+            max_size=self._max_size)
@@ -4,9 +4,17 @@ import ipinfo
 import sqlalchemy.ext.asyncio as sqlalchemy_asyncio
 from dependency_injector import containers, providers
 
-from app.services import AuthorizationService, DatetimeService, UserService, EmailService, LocationService
+from app.services import AuthorizationService, DatetimeService, UserService, EmailService, LocationService, IdService
 from app.services.room_service import RoomService
-from app.services.message_service import MessageService
+from app.services.message_service import MessageService, OverflowPolicy
+from app.services.password_service import PasswordService
+from app.services.broadcast_service import BroadcastService
+from app.services.message_log import MessageLog, FsyncPolicy
+from app.services.message_cache import RoomMessageCache
+from app.services.unread_counter_service import UnreadCounterService
+from app.services.ephemeral_event_service import EphemeralEventService
+from app.services.presence_service import PresenceService
+from app.services.username_autocomplete_service import UsernameAutocompleteService
 
 class Container(containers.DeclarativeContainer):
     wiring_config = containers.WiringConfiguration(packages=['app.routers'])
@@ -23,16 +31,11 @@ class Container(containers.DeclarativeContainer):
     db_sessionmaker = providers.Factory(
         sqlalchemy_asyncio.async_sessionmaker,
         db_engine)
-    auth_service = providers.Factory(
-        AuthorizationService,
-        ipinfo_handler,
-        db_sessionmaker,
-        config.security.min_password_length.as_int(),
+    password_service = providers.Singleton(
+        PasswordService,
         config.security.password_salt_rounds.as_int(),
-        config.security.jwt_secret,
-        config.security.jwt_expire_time.as_(lambda x: datetime.timedelta(seconds=int(x))),
-        config.security.email_verification_key,
-        config.security.email_confirm_code_max_age.as_int())
+        config.security.password_hash_workers.as_int(),
+        config.security.password_hash_queue_size.as_int())
     location_service = providers.Factory(
         LocationService,
         ipinfo_handler)
@@ -44,18 +47,88 @@ class Container(containers.DeclarativeContainer):
         config.smtp.password,
         config.fs.data_directory.as_(pathlib.Path))
     datetime_service = providers.Singleton(DatetimeService)
+    id_service = providers.Singleton(
+        IdService,
+        config.id.worker_id.as_int())
+    unread_counter_service = providers.Singleton(
+        UnreadCounterService,
+        db_engine,
+        config.message.unread_flush_interval.as_float())
+    broadcast_service = providers.Singleton(
+        BroadcastService,
+        config.websocket.subscriber_queue_size.as_int())
+    ephemeral_event_service = providers.Singleton(
+        EphemeralEventService,
+        broadcast_service,
+        config.websocket.ephemeral_event_interval.as_float())
+    presence_service = providers.Singleton(
+        PresenceService,
+        ephemeral_event_service,
+        config.user.presence_timeout.as_float(),
+        config.user.presence_resolution.as_float())
     user_service = providers.Singleton(
         UserService,
         db_sessionmaker,
         config.fs.data_directory.as_(pathlib.Path),
-        config.user.profile_picture_size.as_int())
-    room_service = providers.Singleton(
-        RoomService,
-        db_sessionmaker)
+        config.user.profile_picture_size.as_int(),
+        unread_counter_service,
+        presence_service,
+        config.user.activity_flush_interval.as_float(),
+        config.user.presence_timeout.as_float(),
+        config.user.activity_sweep_interval.as_float(),
+        config.user.profile_cache_size.as_int(),
+        config.user.profile_cache_ttl.as_float())
+    room_message_cache = providers.Singleton(
+        RoomMessageCache,
+        config.message.cache_room_size.as_int(),
+        config.message.cache_max_messages.as_int())
+    message_log = providers.Singleton(
+        lambda enabled, directory, fsync_policy, fsync_interval, segment_size: MessageLog(directory, fsync_policy, fsync_interval, segment_size) if enabled else None,
+        config.message.log_enabled.as_(lambda x: x.lower() in ('1', 'true', 'yes')),
+        config.fs.data_directory.as_(lambda x: pathlib.Path(x) / 'message_log'),
+        config.message.log_fsync_policy.as_(lambda x: FsyncPolicy(x.upper())),
+        config.message.log_fsync_interval.as_float(),
+        config.message.log_segment_size.as_int())
     message_service = providers.Singleton(
         MessageService,
+        db_engine,
+        broadcast_service,
+        message_log,
+        room_message_cache,
+        unread_counter_service,
+        db_writer_tasks=config.message.db_writer_tasks.as_int(),
+        message_queue_size=config.message.queue_size.as_int(),
+        overflow_policy=config.message.overflow_policy.as_(lambda x: OverflowPolicy(x.upper())),
+        overflow_block_timeout=config.message.overflow_block_timeout.as_float(),
+        overflow_spill_size=config.message.overflow_spill_size.as_int(),
+        min_batch_size=config.message.min_batch_size.as_int(),
+        max_batch_size=config.message.max_batch_size.as_int(),
+        min_batch_linger=config.message.min_batch_linger.as_float(),
+        max_batch_linger=config.message.max_batch_linger.as_float())
+    room_service = providers.Singleton(
+        RoomService,
+        db_sessionmaker,
+        room_message_cache,
+        message_service,
+        config.room.membership_cache_size.as_int(),
+        config.room.membership_cache_ttl.as_float())
+    username_autocomplete_service = providers.Singleton(
+        UsernameAutocompleteService,
+        db_sessionmaker,
+        config.user.autocomplete_cache_size.as_int(),
+        config.user.autocomplete_cache_ttl.as_float())
+    auth_service = providers.Singleton(
+        AuthorizationService,
+        ipinfo_handler,
         db_sessionmaker,
-        db_writer_tasks=1,
-        message_queue_size=32,
-        message_upload_batch_size=8,
-        message_upload_batch_timeout=3.0)
\ No newline at end of file
+        config.security.min_password_length.as_int(),
+        password_service,
+        room_service,
+        username_autocomplete_service,
+        user_service,
+        config.security.jwt_secret,
+        config.security.jwt_expire_time.as_(lambda x: datetime.timedelta(seconds=int(x))),
+        config.security.email_verification_key,
+        config.security.email_confirm_code_max_age.as_int(),
+        config.security.api_key_cache_size.as_int(),
+        config.security.api_key_cache_ttl.as_float())
\ No newline at end of file
@@ -5,19 +5,39 @@ from dependency_injector.wiring import inject, Provide
 
 from app.models.sql import Base
 from app.services.message_service import MessageService
+from app.services.password_service import PasswordService
+from app.services.unread_counter_service import UnreadCounterService
+from app.services.user_service import UserService
+from app.services.presence_service import PresenceService
+from app.services.username_autocomplete_service import UsernameAutocompleteService
 
 @contextlib.asynccontextmanager
 @inject
 async def lifespan(app: fastapi.FastAPI,
                    db_engine: AsyncEngine = Provide['db_engine'],
-                   message_service: MessageService = Provide['message_service']):
+                   message_service: MessageService = Provide['message_service'],
+                   password_service: PasswordService = Provide['password_service'],
+                   unread_counter_service: UnreadCounterService = Provide['unread_counter_service'],
+                   user_service: UserService = Provide['user_service'],
+                   presence_service: PresenceService = Provide['presence_service'],
+                   username_autocomplete_service: UsernameAutocompleteService = Provide['username_autocomplete_service']):
     # startup
     async with db_engine.begin() as connection:
         await connection.run_sync(Base.metadata.create_all)
     
-    message_service.start_db_writer_task()
+    await username_autocomplete_service.load()
+    await message_service.recover_logged_messages()
+    message_service.start_db_writer_tasks()
+    unread_counter_service.start()
+    user_service.start_activity_tasks()
+    presence_service.start()
     
     yield
 
     #cleanup
-    await message_service.shutdown_db_writer_task()
\ No newline at end of file
+    await message_service.shutdown_db_writer_tasks()
+    # writers are stopped first, so messages they stored on shutdown are counted in as well
+    await unread_counter_service.shutdown()
+    await user_service.shutdown_activity_tasks()
+    await presence_service.shutdown()
+    password_service.shutdown()
\ No newline at end of file
@@ -12,18 +12,51 @@ dependency_container.config.db.address.from_env('DB_ADDRESS')
 dependency_container.config.ipinfo.access_token.from_env('IPINFO_ACCESS_TOKEN')
 dependency_container.config.security.min_password_length.from_env('MIN_PASSWORD_LENGTH')
 dependency_container.config.security.password_salt_rounds.from_env('PASSWORD_SALT_ROUNDS')
+dependency_container.config.security.password_hash_workers.from_env('PASSWORD_HASH_WORKERS', default='2')
+dependency_container.config.security.password_hash_queue_size.from_env('PASSWORD_HASH_QUEUE_SIZE', default='32')
 dependency_container.config.security.jwt_secret.from_env('JWT_SECRET')
 dependency_container.config.security.jwt_expire_time.from_env('JWT_EXPIRE_TIME')
 dependency_container.config.security.email_verification_key.from_env('EMAIL_VERIFICATION_KEY')
 dependency_container.config.security.email_verification_salt.from_env('EMAIL_VERIFICATION_SALT')
 dependency_container.config.security.email_confirm_code_max_age.from_env('EMAIL_CONFIRM_CODE_MAX_AGE')
 dependency_container.config.security.email_verification_token_salt_rounds.from_env('EMAIL_VERIFICATION_TOKEN_SALT_ROUNDS')
+dependency_container.config.security.api_key_cache_size.from_env('API_KEY_CACHE_SIZE', default='1024')
+dependency_container.config.security.api_key_cache_ttl.from_env('API_KEY_CACHE_TTL', default='60')
 dependency_container.config.smtp.host.from_env('SMTP_HOST')
 dependency_container.config.smtp.port.from_env('SMTP_PORT')
 dependency_container.config.smtp.user.from_env('SMTP_USER')
 dependency_container.config.smtp.password.from_env('SMTP_PASSWORD')
 dependency_container.config.fs.data_directory.from_env('FS_DATA_DIRECTORY')
 dependency_container.config.user.profile_picture_size.from_env('PROFILE_PICTURE_SIZE')
+dependency_container.config.user.activity_flush_interval.from_env('USER_ACTIVITY_FLUSH_INTERVAL', default='5.0')
+dependency_container.config.user.presence_timeout.from_env('USER_PRESENCE_TIMEOUT', default='180')
+dependency_container.config.user.presence_resolution.from_env('USER_PRESENCE_RESOLUTION', default='1.0')
+dependency_container.config.user.activity_sweep_interval.from_env('USER_ACTIVITY_SWEEP_INTERVAL', default='30')
+dependency_container.config.user.autocomplete_cache_size.from_env('USER_AUTOCOMPLETE_CACHE_SIZE', default='1024')
+dependency_container.config.user.autocomplete_cache_ttl.from_env('USER_AUTOCOMPLETE_CACHE_TTL', default='30')
+dependency_container.config.user.profile_cache_size.from_env('USER_PROFILE_CACHE_SIZE', default='4096')
+dependency_container.config.user.profile_cache_ttl.from_env('USER_PROFILE_CACHE_TTL', default='30')
+dependency_container.config.websocket.subscriber_queue_size.from_env('WEBSOCKET_SUBSCRIBER_QUEUE_SIZE', default='64')
+dependency_container.config.websocket.ephemeral_event_interval.from_env('WEBSOCKET_EPHEMERAL_EVENT_INTERVAL', default='1.0')
+dependency_container.config.message.db_writer_tasks.from_env('MESSAGE_DB_WRITER_TASKS', default='4')
+dependency_container.config.message.queue_size.from_env('MESSAGE_QUEUE_SIZE', default='32')
+dependency_container.config.message.overflow_policy.from_env('MESSAGE_OVERFLOW_POLICY', default='BLOCK')
+dependency_container.config.message.overflow_block_timeout.from_env('MESSAGE_OVERFLOW_BLOCK_TIMEOUT', default='1.0')
+dependency_container.config.message.overflow_spill_size.from_env('MESSAGE_OVERFLOW_SPILL_SIZE', default='1024')
+dependency_container.config.message.min_batch_size.from_env('MESSAGE_MIN_BATCH_SIZE', default='1')
+dependency_container.config.message.max_batch_size.from_env('MESSAGE_MAX_BATCH_SIZE', default='256')
+dependency_container.config.message.min_batch_linger.from_env('MESSAGE_MIN_BATCH_LINGER', default='0.0')
+dependency_container.config.message.max_batch_linger.from_env('MESSAGE_MAX_BATCH_LINGER', default='0.5')
+dependency_container.config.message.cache_room_size.from_env('MESSAGE_CACHE_ROOM_SIZE', default='50')
+dependency_container.config.message.cache_max_messages.from_env('MESSAGE_CACHE_MAX_MESSAGES', default='100000')
+dependency_container.config.message.log_enabled.from_env('MESSAGE_LOG_ENABLED', default='false')
+dependency_container.config.message.log_fsync_policy.from_env('MESSAGE_LOG_FSYNC_POLICY', default='BATCH')
+dependency_container.config.message.log_fsync_interval.from_env('MESSAGE_LOG_FSYNC_INTERVAL', default='1.0')
+dependency_container.config.message.log_segment_size.from_env('MESSAGE_LOG_SEGMENT_SIZE', default='1048576')
+dependency_container.config.message.unread_flush_interval.from_env('MESSAGE_UNREAD_FLUSH_INTERVAL', default='1.0')
+dependency_container.config.room.membership_cache_size.from_env('ROOM_MEMBERSHIP_CACHE_SIZE', default='4096')
+dependency_container.config.room.membership_cache_ttl.from_env('ROOM_MEMBERSHIP_CACHE_TTL', default='300')
+dependency_container.config.id.worker_id.from_env('ID_WORKER_ID', default='0')
 dependency_container.wire(
     packages=['app.routers'],
     modules=['app.middleware', 'app.lifespan'],
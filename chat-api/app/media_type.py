@@ -3,6 +3,7 @@ import enum
 class MediaType(enum.StrEnum):
     # --- Application ---
     APPLICATION_JSON = 'application/json'
+    APPLICATION_NDJSON = 'application/x-ndjson'
     APPLICATION_JAVASCRIPT = 'application/javascript'
     APPLICATION_XML = 'application/xml'
     APPLICATION_XHTML = 'application/xhtml+xml'
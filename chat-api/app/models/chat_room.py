@@ -6,9 +6,8 @@ import enum
 from sqlalchemy import sql, orm
 
 from app.models.sql import Base
-from app.models.message import RoomMessage
+from app.models.message import RoomMessage, MessageType, MAX_MESSAGE_LENGTH
 from app.models.user import APIUserForeign, UserActivityStatus, SQLUser
-from app.models.last_room_message import SQLLastRoomMessage
 from app.models.chat_room_user import SQLChatRoomUser
 
 _CHAT_ROOM_NAME_MAX_LENGTH = 256
@@ -48,16 +47,29 @@ class SQLChatRoom(Base):
         sqlalchemy.BigInteger,
         sqlalchemy.ForeignKey('users.id', ondelete='CASCADE'),
         nullable=True)
+    # preview of the newest message, maintained by the message writer together with each inserted batch
+    last_message_id: orm.Mapped[int | None] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        nullable=True)
+    last_message_type: orm.Mapped[MessageType | None] = orm.mapped_column(
+        sqlalchemy.Enum(
+            MessageType,
+            name='message_type_enum'),
+        nullable=True)
+    last_message_content: orm.Mapped[str | None] = orm.mapped_column(
+        sqlalchemy.String(length=MAX_MESSAGE_LENGTH),
+        nullable=True)
+    last_message_sent_at: orm.Mapped[datetime.datetime | None] = orm.mapped_column(
+        sqlalchemy.DateTime(),
+        nullable=True)
+    last_message_sender_id: orm.Mapped[int | None] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        nullable=True)
     
     users: orm.Mapped[list['SQLChatRoomUser']] = orm.relationship(
         'SQLChatRoomUser',
         back_populates='room',
         lazy='selectin')
-    last_message: orm.Mapped['SQLLastRoomMessage'] = orm.relationship(
-        'SQLLastRoomMessage',
-        primaryjoin=orm.foreign(SQLLastRoomMessage.room_id) == id,
-        viewonly=True,
-        uselist=False)
     
 class APIUserChatRoom(pydantic.BaseModel):
     model_config = {'from_attributes': True}
@@ -66,6 +78,8 @@ class APIUserChatRoom(pydantic.BaseModel):
     type: RoomType
     name: str
     last_message: RoomMessage | None
+    last_read_message_id: int
+    unread_count: int
 
 class APIChatRoomUser(pydantic.BaseModel):
     model_config = {'from_attributes': True}
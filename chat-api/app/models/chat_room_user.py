@@ -27,6 +27,15 @@ class SQLChatRoomUser(Base):
         sqlalchemy.DateTime,
         nullable=False,
         server_default=sql.func.now())
+    last_read_message_id: orm.Mapped[int] = orm.mapped_column(
+        sqlalchemy.BigInteger,
+        nullable=False,
+        server_default='0')
+    # maintained incrementally by UnreadCounterService
+    unread_count: orm.Mapped[int] = orm.mapped_column(
+        sqlalchemy.Integer,
+        nullable=False,
+        server_default='0')
     
     room: orm.Mapped['SQLChatRoom'] = orm.relationship(
         'SQLChatRoom',
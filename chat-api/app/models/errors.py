@@ -191,3 +191,17 @@ class ErrorRoomDeleteInternal(Error):
 class ErrorDatabaseFail(Error):
     error_code: str = 'database_fail'
     error_message: str = 'Database operation failed.'
+
+class ErrorPasswordHashingOverloaded(Error):
+    error_code: str = 'password_hashing_overloaded'
+    error_message: str = 'Too many password operations in progress. Try again later.'
+
+class ErrorMessageRejected(Error):
+    room_id: int
+    reason: str
+    error_code: str = 'message_rejected'
+    error_message: str = 'Message could not be stored in the chat room.'
+
+class ErrorMessageQueueFull(Error):
+    error_code: str = 'message_queue_full'
+    error_message: str = 'Server is overloaded and cannot accept more messages right now. Try again later.'
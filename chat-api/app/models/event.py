@@ -0,0 +1,29 @@
+import typing
+import pydantic
+
+from app.models.message import MessageIncoming
+from app.models.user import UserActivityStatus
+
+class MessageEvent(pydantic.BaseModel):
+    event: typing.Literal['message'] = 'message'
+    message: MessageIncoming
+
+class MessageRejectedEvent(pydantic.BaseModel):
+    '''
+    Sent to room subscribers when an already broadcast message could not be stored.
+    '''
+
+    event: typing.Literal['message_rejected'] = 'message_rejected'
+    message_id: int
+    room_id: int
+
+class TypingEvent(pydantic.BaseModel):
+    event: typing.Literal['typing'] = 'typing'
+    room_id: int
+    user_id: int
+    is_typing: bool
+
+class PresenceEvent(pydantic.BaseModel):
+    event: typing.Literal['presence'] = 'presence'
+    user_id: int
+    status: UserActivityStatus
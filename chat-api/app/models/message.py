@@ -1,7 +1,8 @@
+import typing
 from enum import StrEnum
 from pydantic import BaseModel
 from datetime import datetime
-from sqlalchemy import DateTime, String, sql, orm, BigInteger, ForeignKey, Enum
+from sqlalchemy import DateTime, String, sql, orm, BigInteger, ForeignKey, Enum, Index
 
 from app.models.sql import Base
 
@@ -14,11 +15,19 @@ class MessageType(StrEnum):
 
 class SQLMessage(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # serves keyset pagination of room history
+        Index('ix_messages_room_id_id', 'room_id', 'id'),
+        # ngram parser tokenizes text without word separators (CJK) as well, server has to run
+        # with `innodb_ft_enable_stopword` off, otherwise ngrams containing a stopword are skipped
+        Index('ix_messages_content_fulltext', 'content', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+    )
 
+    # IDs are generated by the application, see IdService
     id: orm.Mapped[int] = orm.mapped_column(
         BigInteger,
         primary_key=True,
-        autoincrement=True)
+        autoincrement=False)
     sender_id: orm.Mapped[int] = orm.mapped_column(
         BigInteger,
         ForeignKey('users.id', ondelete='CASCADE'),
@@ -43,10 +52,12 @@ class SQLMessage(Base):
 class MessageIncoming(BaseModel):
     model_config = {'from_attributes': True}
 
+    id: int
     sender_id: int
     room_id: int
     content: str
     type: MessageType
+    sent_at: datetime
 
     @property
     def is_text_message(self) -> bool:
@@ -68,4 +79,19 @@ class RoomMessage(BaseModel):
     content: str
     sent_at: datetime
     sender_id: int
-    sender_username: str
\ No newline at end of file
+    sender_username: str
+    pending: bool = False
+    '''
+    Whether message was accepted, but is still waiting to be stored
+    '''
+
+RoomMessageRow = dict[str, typing.Any]
+'''
+`RoomMessage` fields as a plain dict. Used on hot read paths, which serialize rows directly without building models.
+'''
+
+class RoomMessageSearchHit(RoomMessage):
+    score: float
+    '''
+    Relevance of the message to the search query, pass it along with message ID to get the next page
+    '''
@@ -0,0 +1,100 @@
+import pydantic
+
+class CacheStats(pydantic.BaseModel):
+    hits: int
+    '''
+    Number of lookups served from the cache
+    '''
+
+    misses: int
+    '''
+    Number of lookups that had to fall back to the source
+    '''
+
+    size: int
+    '''
+    Current number of cached entries
+    '''
+
+    max_size: int
+    '''
+    Maximum number of cached entries
+    '''
+
+    @pydantic.computed_field
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+class MessageBatchingStats(pydantic.BaseModel):
+    batch_size: int
+    '''
+    Current target size of writer batches
+    '''
+
+    linger: float
+    '''
+    Current time in seconds the writer waits for a batch to fill up
+    '''
+
+    insert_latency: float | None
+    '''
+    Smoothed INSERT latency in seconds or `None` if nothing was written yet
+    '''
+
+    batch_size_histogram: dict[int, int]
+    '''
+    Number of flushed batches keyed by power of two upper bound of their size
+    '''
+
+    flush_reasons: dict[str, int]
+    '''
+    Number of flushed batches keyed by the reason of flush
+    '''
+
+class MessageWriterStats(pydantic.BaseModel):
+    queue_size: int
+    '''
+    Number of messages waiting in the writer queue
+    '''
+
+    queue_high_water_mark: int
+    '''
+    Highest number of messages waiting for the writer (including spilled ones) since startup
+    '''
+
+    spill_size: int
+    '''
+    Number of messages waiting in the overflow buffer
+    '''
+
+    messages_spilled: int
+    '''
+    Number of messages that went through the overflow buffer since startup
+    '''
+
+    messages_overflowed: int
+    '''
+    Number of messages rejected with 503 because the writer was overloaded
+    '''
+
+    messages_written: int
+    '''
+    Number of messages committed by the writer since startup
+    '''
+
+    messages_rejected: int
+    '''
+    Number of messages that could not be stored since startup
+    '''
+
+    batches_written: int
+    '''
+    Number of INSERT batches committed by the writer since startup
+    '''
+
+    batching: MessageBatchingStats
+    '''
+    Decisions of the adaptive batching policy
+    '''
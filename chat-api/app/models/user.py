@@ -16,8 +16,22 @@ class UserActivityStatus(enum.StrEnum):
     BRB = 'BRB'
     DONT_DISTURB = 'DONT_DISTURB'
 
+# order of statuses in user lists, native ENUM columns would sort by declaration order instead
+_ACTIVITY_STATUS_RANKS = (
+    UserActivityStatus.ACTIVE,
+    UserActivityStatus.BRB,
+    UserActivityStatus.DONT_DISTURB,
+    UserActivityStatus.OFFLINE)
+
 class SQLUser(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # serves filtering and ordering users by status as well as sweeping stale users to offline
+        sqlalchemy.Index('ix_users_activity_status_last_active', 'activity_status', 'last_active'),
+        # serves substring search, ngram parser indexes every `ngram_token_size` long part of the username,
+        # server has to run with `innodb_ft_enable_stopword` off, otherwise parts containing a stopword are skipped
+        sqlalchemy.Index('ix_users_username_fulltext', 'username', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+    )
 
     id: orm.Mapped[int] = orm.mapped_column(
         sqlalchemy.BigInteger,
@@ -57,17 +71,29 @@ class SQLUser(Base):
             native_enum=True),
         nullable=False,
         server_default=UserActivityStatus.OFFLINE.value)
-    activity_status: typing.ClassVar[UserActivityStatus] = orm.column_property(
-        sql.func.if_(
-            last_active < sql.func.date_sub(sql.func.now(), sql.text('INTERVAL 3 MINUTE')),
-            UserActivityStatus.OFFLINE.value,
-            user_activity_status)
-        .cast(sqlalchemy.Enum(UserActivityStatus)))
+    # effective status: `user_activity_status` while the user is active, OFFLINE once UserService
+    # sweeps them as stale
+    activity_status: orm.Mapped[UserActivityStatus] = orm.mapped_column(
+        sqlalchemy.Enum(
+            UserActivityStatus,
+            name='activity_status_enum',
+            native_enum=True),
+        nullable=False,
+        server_default=UserActivityStatus.OFFLINE.value)
+    # position of `activity_status` in user lists, see `_ACTIVITY_STATUS_RANKS`
+    activity_rank: orm.Mapped[int] = orm.mapped_column(
+        sqlalchemy.SmallInteger,
+        sqlalchemy.Computed(
+            'FIELD(activity_status, {})'.format(', '.join(f"'{x.value}'" for x in _ACTIVITY_STATUS_RANKS)),
+            persisted=True))
     
     rooms: orm.Mapped[list['SQLChatRoomUser']] = orm.relationship(
         'SQLChatRoomUser',
         back_populates='user')
     
+# serves user lists ordered by status, most recently active first
+sqlalchemy.Index('ix_users_activity_rank_last_active', SQLUser.activity_rank, SQLUser.last_active.desc())
+
 class APIUserSelf(pydantic.BaseModel):
     model_config = {'from_attributes': True}
 
@@ -90,15 +116,20 @@ class APIUserForeign(pydantic.BaseModel):
     last_active: datetime.datetime
     activity_status: UserActivityStatus
 
-class APIUserSearchResult(pydantic.BaseModel):
-    query: str
+class APIUsernameMatch(pydantic.BaseModel):
+    id: int
+    username: str
+
+class APIUserSearchHit(APIUserForeign):
+    is_prefix_match: bool
     '''
-    A search string that was provided
+    Whether the username starts with the search string, pass it along with the username to get the next page
     '''
 
-    offset: int
+class APIUserSearchResult(pydantic.BaseModel):
+    query: str
     '''
-    Results offset
+    A search string that was provided
     '''
 
     limit: int
@@ -106,7 +137,7 @@ class APIUserSearchResult(pydantic.BaseModel):
     Max amount of results
     '''
 
-    users: list[APIUserForeign]
+    users: list[APIUserSearchHit]
     '''
-    List of users that match the search criteria
+    List of users that match the search criteria, users which username starts with the search string come first
     '''
\ No newline at end of file
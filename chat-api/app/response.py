@@ -0,0 +1,14 @@
+import typing as t
+import fastapi
+import orjson
+
+class RowsJSONResponse(fastapi.responses.JSONResponse):
+    '''
+    Serializes plain rows (dicts, lists, enums, datetimes) straight to JSON bytes with orjson.
+    Meant for list endpoints returning many rows read from the database, where building and validating
+    a pydantic model per row costs more than the query itself. Content is not validated, so
+    endpoints using it should document their schema using `responses`.
+    '''
+
+    def render(self, content: t.Any) -> bytes:
+        return orjson.dumps(content)
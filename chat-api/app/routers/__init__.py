@@ -2,9 +2,11 @@ from .auth import router as auth_router
 from .user import router as user_router
 from .room import router as room_router
 from .search import router as search_router
+from .metrics import router as metrics_router
 
 __all__ = (
     'auth_router',
     'user_router',
     'room_router',
-    'search_router')
\ No newline at end of file
+    'search_router',
+    'metrics_router')
\ No newline at end of file
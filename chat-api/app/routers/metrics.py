@@ -0,0 +1,80 @@
+import fastapi
+from dependency_injector.wiring import Provide, inject
+
+from app.services.auth_service import AuthorizationService
+from app.services.message_service import MessageService
+from app.services.message_cache import RoomMessageCache
+from app.services.room_service import RoomService
+from app.services.username_autocomplete_service import UsernameAutocompleteService
+from app.services.user_service import UserService
+from app.models.metrics import CacheStats, MessageWriterStats
+
+router = fastapi.APIRouter(
+    prefix='/metrics',
+    tags=['metrics'])
+
+@router.get(
+    '/api-key-cache',
+    name='Get API key cache statistics')
+@inject
+async def get_api_key_cache_metrics(auth_service: AuthorizationService = fastapi.Depends(Provide['auth_service'])) -> CacheStats:
+    '''
+    Returns hit/miss counters of the in-process API key status cache.
+    '''
+
+    return auth_service.get_api_key_cache_stats()
+
+@router.get(
+    '/message-writers',
+    name='Get message writers statistics')
+@inject
+async def get_message_writers_metrics(message_service: MessageService = fastapi.Depends(Provide['message_service'])) -> list[MessageWriterStats]:
+    '''
+    Returns queue depth and throughput counters of every message database writer.
+    '''
+
+    return message_service.get_writer_stats()
+
+@router.get(
+    '/room-message-cache',
+    name='Get room message cache statistics')
+@inject
+async def get_room_message_cache_metrics(room_message_cache: RoomMessageCache = fastapi.Depends(Provide['room_message_cache'])) -> CacheStats:
+    '''
+    Returns hit/miss counters and number of messages held by the recent room messages cache.
+    '''
+
+    return room_message_cache.get_stats()
+
+@router.get(
+    '/room-membership-cache',
+    name='Get room membership cache statistics')
+@inject
+async def get_room_membership_cache_metrics(room_service: RoomService = fastapi.Depends(Provide['room_service'])) -> CacheStats:
+    '''
+    Returns hit/miss counters and number of rooms held by the room membership cache.
+    '''
+
+    return room_service.get_membership_cache_stats()
+
+@router.get(
+    '/username-autocomplete-cache',
+    name='Get username autocomplete cache statistics')
+@inject
+async def get_username_autocomplete_cache_metrics(username_autocomplete_service: UsernameAutocompleteService = fastapi.Depends(Provide['username_autocomplete_service'])) -> CacheStats:
+    '''
+    Returns hit/miss counters and number of prefixes held by the username autocomplete cache.
+    '''
+
+    return username_autocomplete_service.get_cache_stats()
+
+@router.get(
+    '/user-profile-cache',
+    name='Get user profile cache statistics')
+@inject
+async def get_user_profile_cache_metrics(user_service: UserService = fastapi.Depends(Provide['user_service'])) -> CacheStats:
+    '''
+    Returns hit/miss counters and number of profiles held by the user profile cache.
+    '''
+
+    return user_service.get_profile_cache_stats()
@@ -1,6 +1,8 @@
 import enum
+import zlib
 import typing
 import fastapi
+import orjson
 import fastapi.security
 import pydantic
 from dependency_injector.wiring import inject, Provide
@@ -8,9 +10,18 @@ from dependency_injector.wiring import inject, Provide
 from app.services.room_service import RoomService, RoomUsersOrder
 from app.services.auth_service import AuthorizationService
 from app.services.message_service import MessageService
-from app.models.chat_room import RoomType
-from app.models.errors import ErrorRoomAlreadyExists, ErrorRoomAlreadyJoined, ErrorRoomInternalJoin, ErrorRoomInvalidTypeChange, ErrorRoomNameTooLong, ErrorRoomNotFound, ErrorRoomNotOwner, ErrorRoomPrivateJoin, ErrorRoomUserNotJoined, ErrorUserJWTExpired, ErrorUserJWTInvalid
-from app.models.message import MessageIncoming, MessageType
+from app.services.datetime_service import DatetimeService
+from app.services.id_service import IdService
+from app.services.unread_counter_service import UnreadCounterService
+from app.services.ephemeral_event_service import EphemeralEventService
+from app.services.broadcast_service import BroadcastService, room_channel
+from app import websocket
+from app.media_type import MediaType
+from app.response import RowsJSONResponse
+from app.models.chat_room import APIChatRoomUser, RoomType
+from app.models.user import UserActivityStatus
+from app.models.errors import ErrorRoomAlreadyExists, ErrorRoomAlreadyJoined, ErrorRoomInternalJoin, ErrorRoomInvalidTypeChange, ErrorRoomNameTooLong, ErrorRoomNotFound, ErrorRoomNotOwner, ErrorRoomPrivateJoin, ErrorRoomUserNotJoined, ErrorUserJWTExpired, ErrorUserJWTInvalid, ErrorMessageRejected, ErrorDatabaseFail, ErrorMessageQueueFull
+from app.models.message import MessageIncoming, MessageType, RoomMessage, RoomMessageRow
 
 class CreateRoomData(pydantic.BaseModel):
     name: str
@@ -26,9 +37,19 @@ class PutRoomMessageData(pydantic.BaseModel):
     content: str
     type: MessageType
 
+class RoomClientEvent(pydantic.BaseModel):
+    event: typing.Literal['typing']
+    is_typing: bool
+
+class MarkRoomReadData(pydantic.BaseModel):
+    message_id: int
+
 class CreateRoomResponse(pydantic.BaseModel):
     room_id: int
 
+class PutRoomMessageResponse(pydantic.BaseModel):
+    message_id: int
+
 oauth2_scheme = fastapi.security.oauth2.OAuth2PasswordBearer(tokenUrl='auth/login')
 router = fastapi.APIRouter(
     prefix='/room',
@@ -75,24 +96,71 @@ async def delete_room(room_id: int,
 
 @router.get(
     '/{room_id}/users',
-    name='Get chat room users')
+    name='Get chat room users',
+    response_class=RowsJSONResponse,
+    responses={fastapi.status.HTTP_200_OK: {'model': list[APIChatRoomUser]}})
 @inject
 async def get_chat_room_users(room_id: int,
                               offset: int = 0,
                               limit: int = 10,
+                              order: RoomUsersOrder = RoomUsersOrder.USERNAME,
+                              status: UserActivityStatus | None = None,
                               room_service: RoomService = fastapi.Depends(Provide['room_service'])):
-    return await room_service.get_room_users(room_id, offset, limit)
+    '''
+    Returns room users. With `status` only users currently having that activity status are returned,
+    e.g. `status=ACTIVE` lists online users of the room.
+    '''
+
+    return RowsJSONResponse(await room_service.get_room_users(room_id, offset, limit, order, status))
 
-# TODO Use websocket
 @router.get(
     '/{room_id}/messages',
-    name='Get last chat room messages')
+    name='Get last chat room messages',
+    response_class=RowsJSONResponse,
+    responses={fastapi.status.HTTP_200_OK: {'model': list[RoomMessage]}})
 @inject
 async def get_last_room_messages(room_id: int,
-                                 offset: int = 0,
                                  limit: int = 10,
+                                 before_id: int | None = None,
+                                 after_id: int | None = None,
                                  room_service: RoomService = fastapi.Depends(Provide['room_service'])):
-    return await room_service.get_last_room_messages(room_id, offset, limit)
+    '''
+    Returns room messages ordered from the newest. To page through history pass ID of the oldest
+    received message as `before_id`, to fetch messages newer than already received pass ID of the newest one as `after_id`.
+    Messages accepted but not stored yet are included on top of the newest page and marked as `pending`.
+    '''
+
+    return RowsJSONResponse(await room_service.get_last_room_messages(room_id, limit, before_id, after_id))
+
+@router.get(
+    '/{room_id}/export',
+    name='Export chat room messages',
+    response_class=fastapi.responses.StreamingResponse,
+    responses={
+        fastapi.status.HTTP_200_OK: {'content': {MediaType.APPLICATION_NDJSON: {}, MediaType.APPLICATION_GZIP: {}}},
+        fastapi.status.HTTP_404_NOT_FOUND: {'model': ErrorRoomUserNotJoined},
+        fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+    })
+@inject
+async def export_room_messages(room_id: int,
+                               gzip: bool = False,
+                               user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                               room_service: RoomService = fastapi.Depends(Provide['room_service'])):
+    '''
+    Streams whole stored room history ordered from the oldest message as newline delimited JSON,
+    one message per line. With `gzip` the stream is compressed and served as a gzip file.
+    '''
+
+    await room_service.check_user_belongs_to(user_id, room_id)
+
+    filename = f'room-{room_id}.ndjson'
+    if gzip:
+        filename += '.gz'
+
+    return fastapi.responses.StreamingResponse(
+        _stream_ndjson(room_service.export_room_messages(room_id), gzip),
+        media_type=MediaType.APPLICATION_GZIP if gzip else MediaType.APPLICATION_NDJSON,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @router.post(
     '/{room_id}/messages',
@@ -101,21 +169,103 @@ async def get_last_room_messages(room_id: int,
     responses={
         fastapi.status.HTTP_404_NOT_FOUND: {'model': ErrorRoomUserNotJoined},
         fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+        fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY: {'model': ErrorMessageRejected},
+        fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR: {'model': ErrorDatabaseFail},
+        fastapi.status.HTTP_503_SERVICE_UNAVAILABLE: {'model': ErrorMessageQueueFull},
     })
 @inject
 async def put_room_message(room_id: int,
                            message_data: PutRoomMessageData,
+                           wait: bool = False,
                            user_id: int = fastapi.Depends(get_user_id_from_jwt),
                            room_service: RoomService = fastapi.Depends(Provide['room_service']),
-                           message_service: MessageService = fastapi.Depends(Provide['message_service'])):
+                           message_service: MessageService = fastapi.Depends(Provide['message_service']),
+                           datetime_service: DatetimeService = fastapi.Depends(Provide['datetime_service']),
+                           id_service: IdService = fastapi.Depends(Provide['id_service'])) -> PutRoomMessageResponse:
+    '''
+    Accepts message for storing and returns its ID right away. The ID identifies the message in room events
+    and history already before the message is stored.
+    '''
+
     await room_service.check_user_belongs_to(user_id, room_id)
 
     message = MessageIncoming(
+        id=id_service.generate(),
         sender_id=user_id,
         room_id=room_id,
         content=message_data.content,
-        type=message_data.type)
-    await message_service.upload_message(message)
+        type=message_data.type,
+        sent_at=datetime_service.get_datetime_utc_now())
+    outcome = await message_service.upload_message(message)
+
+    # by default message is only queued, `wait` lets the client learn if it was actually stored
+    if wait:
+        error = await outcome
+        if isinstance(error, ErrorMessageRejected):
+            error.raise_(fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if error is not None:
+            error.raise_()
+
+    return PutRoomMessageResponse(message_id=message.id)
+
+@router.post(
+    '/{room_id}/read',
+    name='Mark chat room messages as read',
+    responses={
+        fastapi.status.HTTP_404_NOT_FOUND: {'model': ErrorRoomUserNotJoined},
+        fastapi.status.HTTP_401_UNAUTHORIZED: {'model': typing.Union[ErrorUserJWTExpired, ErrorUserJWTInvalid]},
+    })
+@inject
+async def mark_room_read(room_id: int,
+                         data: MarkRoomReadData,
+                         user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                         room_service: RoomService = fastapi.Depends(Provide['room_service']),
+                         unread_counter_service: UnreadCounterService = fastapi.Depends(Provide['unread_counter_service'])):
+    '''
+    Marks all room messages up to and including the given one as read. Read marker never moves backwards.
+    '''
+
+    await room_service.check_user_belongs_to(user_id, room_id)
+    await unread_counter_service.mark_read(room_id, user_id, data.message_id)
+
+@router.websocket('/{room_id}/ws')
+@inject
+async def room_websocket(socket: fastapi.WebSocket,
+                         room_id: int,
+                         auth_service: AuthorizationService = fastapi.Depends(Provide['auth_service']),
+                         room_service: RoomService = fastapi.Depends(Provide['room_service']),
+                         broadcast_service: BroadcastService = fastapi.Depends(Provide['broadcast_service']),
+                         ephemeral_event_service: EphemeralEventService = fastapi.Depends(Provide['ephemeral_event_service'])):
+    '''
+    Streams messages accepted for the room and typing indicators of its members as they arrive.
+    Client signals typing by sending `{"event": "typing", "is_typing": true}`, other client messages are ignored.
+    User JWT is passed in `token` query parameter and API key either in `X-Api-Key` header or `api_key`
+    query parameter. Connection is closed with 1008 if authentication fails and with 1013 if the client
+    cannot keep up with the room traffic.
+    '''
+
+    try:
+        user_id = await websocket.authenticate(socket, auth_service)
+        await room_service.check_user_belongs_to(user_id, room_id)
+    except fastapi.HTTPException as e:
+        await websocket.close_with_error(socket, e)
+        return
+
+    await socket.accept()
+
+    async def on_client_message(data: str) -> None:
+        try:
+            event = RoomClientEvent.model_validate_json(data)
+        except pydantic.ValidationError:
+            return
+
+        ephemeral_event_service.publish_typing(room_id, user_id, event.is_typing)
+
+    subscription = broadcast_service.subscribe(room_channel(room_id))
+    try:
+        await websocket.serve_subscription(socket, subscription, on_client_message)
+    finally:
+        broadcast_service.unsubscribe(subscription)
 
 @router.post(
     '/{room_id}/join',
@@ -150,3 +300,17 @@ async def create_room(data: CreateRoomData,
     user_id = auth_service.decode_jwt(user_jwt)
     room_id = await room_service.create_room(user_id, data.name, data.description, data.type)
     return CreateRoomResponse(room_id=room_id)
+
+async def _stream_ndjson(batches: typing.AsyncIterator[list[RoomMessageRow]], compress: bool) -> typing.AsyncIterator[bytes]:
+    # wbits=31 makes zlib produce gzip container instead of raw zlib stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    async for batch in batches:
+        chunk = b''.join(orjson.dumps(x, option=orjson.OPT_APPEND_NEWLINE) for x in batch)
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+
+        if chunk:
+            yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
@@ -1,9 +1,17 @@
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Query
 from fastapi.security.oauth2 import OAuth2PasswordBearer
 from dependency_injector.wiring import Provide, inject
 
 from app.services.user_service import UserService
 from app.services.auth_service import AuthorizationService
+from app.services.room_service import RoomService
+from app.services.username_autocomplete_service import UsernameAutocompleteService
+from app.response import RowsJSONResponse
+from app.models.message import RoomMessageSearchHit
+from app.models.user import APIUsernameMatch, APIUserSearchResult
+
+# max number of messages returned in a single page of room search results
+_MAX_ROOM_MESSAGE_SEARCH_LIMIT = 50
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/login')
 router = APIRouter(
@@ -19,7 +27,45 @@ def get_user_id_from_jwt(user_jwt: str = Depends(oauth2_scheme),
 @inject
 async def get_search_users(search_str: str,
                            limit: int = 20,
-                           offset: int = 0,
+                           cursor_prefix: bool | None = None,
+                           cursor_username: str | None = None,
                            user_id: int = Depends(get_user_id_from_jwt),
-                           user_service: UserService = Depends(Provide['user_service'])):
-    return await user_service.search_users_by_username(user_id, search_str, limit, offset)
\ No newline at end of file
+                           user_service: UserService = Depends(Provide['user_service'])) -> APIUserSearchResult:
+    '''
+    Searches users which username contains the search string, users which username starts with it come first.
+    '''
+
+    return await user_service.search_users_by_username(user_id, search_str, limit, cursor_prefix, cursor_username)
+
+@router.get(
+    '/user-autocomplete/{prefix}',
+    response_class=RowsJSONResponse,
+    responses={200: {'model': list[APIUsernameMatch]}})
+@inject
+async def get_autocomplete_usernames(prefix: str,
+                                     limit: int = 10,
+                                     user_id: int = Depends(get_user_id_from_jwt),
+                                     username_autocomplete_service: UsernameAutocompleteService = Depends(Provide['username_autocomplete_service'])):
+    '''
+    Returns users which username starts with the prefix, ordered by username. Meant to be called
+    on every keystroke, at most 20 users are returned.
+    '''
+
+    return RowsJSONResponse(username_autocomplete_service.get_matches(prefix, limit, user_id))
+
+@router.get('/room/{room_id}/messages')
+@inject
+async def get_search_room_messages(room_id: int,
+                                   q: str,
+                                   limit: int = Query(20, ge=1, le=_MAX_ROOM_MESSAGE_SEARCH_LIMIT),
+                                   cursor_score: float | None = None,
+                                   cursor_id: int | None = None,
+                                   user_id: int = Depends(get_user_id_from_jwt),
+                                   room_service: RoomService = Depends(Provide['room_service'])) -> list[RoomMessageSearchHit]:
+    '''
+    Searches messages of a room the user belongs to, ordered from the most relevant. At most 50 messages
+    are returned at once.
+    '''
+
+    await room_service.check_user_belongs_to(user_id, room_id)
+    return await room_service.search_room_messages(room_id, q, limit, cursor_score, cursor_id)
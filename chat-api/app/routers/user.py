@@ -1,3 +1,4 @@
+import typing
 import pydantic
 import datetime
 import fastapi
@@ -5,15 +6,25 @@ import fastapi.security
 from dependency_injector.wiring import Provide, inject
 
 from app.services import UserService, AuthorizationService, DatetimeService
-from app.models.user import APIUserForeign, APIUserSelf, SQLUser, UserActivityStatus
+from app.services.broadcast_service import BroadcastService, presence_channel
+from app.services.presence_service import PresenceService
+from app import websocket
+from app.models.user import APIUserForeign, APIUserSelf, UserActivityStatus
+from app.models.friend import APIFriend, APIFriendActivity
+from app.models.chat_room import APIUserChatRoom
 from app.models.errors import ErrorFriendRequestAlreadySent, ErrorSelfFriendRequest, ErrorUserNotFoundID
 from app.media_type import MediaType
+from app.response import RowsJSONResponse
 
 class ChangeUserActivityStatusResponse(pydantic.BaseModel):
     activity_status: UserActivityStatus
     last_active: datetime.datetime
     message: str = 'Successfully changed user activity status.'
 
+class UserClientEvent(pydantic.BaseModel):
+    event: typing.Literal['presence']
+    status: UserActivityStatus
+
 class SendFriendRequestResponse(pydantic.BaseModel):
     message: str = 'Sent friend request.'
 
@@ -31,8 +42,8 @@ router = fastapi.APIRouter(
 @inject
 async def get_user_from_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
                             auth_service: AuthorizationService = fastapi.Depends(Provide['auth_service']),
-                            user_service: UserService = fastapi.Depends(Provide['user_service'])):
-    return await user_service.get_user(auth_service.decode_jwt(user_jwt))
+                            user_service: UserService = fastapi.Depends(Provide['user_service'])) -> APIUserSelf:
+    return await user_service.get_user_profile(auth_service.decode_jwt(user_jwt))
 
 @inject
 def get_user_id_from_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
@@ -42,12 +53,12 @@ def get_user_id_from_jwt(user_jwt: str = fastapi.Depends(oauth2_scheme),
 @router.get(
     '/',
     name='Get user')
-async def get_user(user: SQLUser = fastapi.Depends(get_user_from_jwt)) -> APIUserSelf:
+async def get_user(user: APIUserSelf = fastapi.Depends(get_user_from_jwt)) -> APIUserSelf:
     '''
     Retrieves basic informations about the user
     '''
 
-    return APIUserSelf.model_validate(user)
+    return user
 
 @router.put(
     '/change-activity-status/{status}',
@@ -107,11 +118,31 @@ async def delete_user_profile_picture(user_id: int = fastapi.Depends(get_user_id
     user_service.delete_user_profile_picture(user_id)
     return {'message': 'Successfully deleted user profile picture'}
 
-@router.get('/friends')
+@router.get(
+    '/friends',
+    response_class=RowsJSONResponse,
+    responses={fastapi.status.HTTP_200_OK: {'model': list[APIFriend]}})
 @inject
-async def get_user_friends(user_id: int = fastapi.Depends(get_user_id_from_jwt),
+async def get_user_friends(status: UserActivityStatus | None = None,
+                           user_id: int = fastapi.Depends(get_user_id_from_jwt),
                            user_service: UserService = fastapi.Depends(Provide['user_service'])):
-    return await user_service.get_user_friends(user_id)
+    '''
+    Returns user's friends ordered by activity status, most recently active first. With `status`
+    only friends currently having that activity status are returned.
+    '''
+
+    return RowsJSONResponse(await user_service.get_user_friends(user_id, status))
+
+@router.get('/friends-activity')
+@inject
+async def get_user_friends_activity(user_id: int = fastapi.Depends(get_user_id_from_jwt),
+                                    user_service: UserService = fastapi.Depends(Provide['user_service'])) -> list[APIFriendActivity]:
+    '''
+    Returns current activity statuses of user's friends. Use `/user/ws` to receive status changes as they happen
+    instead of polling.
+    '''
+
+    return await user_service.get_user_friends_activity(user_id)
 
 @router.get('/friend-requests')
 @inject
@@ -155,17 +186,20 @@ async def reject_friend_request(from_id: int,
     await user_service.process_friend_request(user_id, from_id, accept=False)
     return RejectFriendRequestResponse()
 
-@router.get('/rooms')
+@router.get(
+    '/rooms',
+    response_class=RowsJSONResponse,
+    responses={fastapi.status.HTTP_200_OK: {'model': list[APIUserChatRoom]}})
 @inject
 async def get_user_rooms(user_id: int = fastapi.Depends(get_user_id_from_jwt),
                          user_service: UserService = fastapi.Depends(Provide['user_service'])):
-    return await user_service.get_user_rooms(user_id)
+    return RowsJSONResponse(await user_service.get_user_rooms(user_id))
 
 @router.get('/{user_id}')
 @inject
 async def get_user_by_id(user_id: int,
-                         user_service: UserService = fastapi.Depends(Provide['user_service'])):
-    return APIUserForeign.model_validate(user_service.get_user(user_id))
+                         user_service: UserService = fastapi.Depends(Provide['user_service'])) -> APIUserForeign:
+    return await user_service.get_user_foreign_profile(user_id)
 
 @router.get('/{user_id}/profile-picture')
 @inject
@@ -184,3 +218,44 @@ async def get_user_profile_picture(user_id: int,
         status_code=status_code,
         media_type=MediaType.IMAGE_JPEG)
 
+@router.websocket('/ws')
+@inject
+async def user_websocket(socket: fastapi.WebSocket,
+                         auth_service: AuthorizationService = fastapi.Depends(Provide['auth_service']),
+                         user_service: UserService = fastapi.Depends(Provide['user_service']),
+                         datetime_service: DatetimeService = fastapi.Depends(Provide['datetime_service']),
+                         broadcast_service: BroadcastService = fastapi.Depends(Provide['broadcast_service']),
+                         presence_service: PresenceService = fastapi.Depends(Provide['presence_service'])):
+    '''
+    Streams presence changes of user's friends. User is kept online with their stored status while connected
+    and can change the announced status by sending `{"event": "presence", "status": "BRB"}`. Presence is not
+    stored, use `/user/change-activity-status` to change the persisted status. Authentication is the same
+    as for room websocket.
+    '''
+
+    try:
+        user_id = await websocket.authenticate(socket, auth_service)
+    except fastapi.HTTPException as e:
+        await websocket.close_with_error(socket, e)
+        return
+
+    friend_ids = await user_service.get_user_friend_ids(user_id)
+
+    await socket.accept()
+
+    async def on_client_message(data: str) -> None:
+        try:
+            event = UserClientEvent.model_validate_json(data)
+        except pydantic.ValidationError:
+            return
+
+        presence_service.set_status(user_id, event.status)
+
+    subscription = broadcast_service.subscribe(*(presence_channel(x) for x in friend_ids))
+    await user_service.refresh_user_activity(user_id, datetime_service.get_datetime_utc_now())
+    presence_service.connect_user(user_id)
+    try:
+        await websocket.serve_subscription(socket, subscription, on_client_message)
+    finally:
+        presence_service.disconnect_user(user_id)
+        broadcast_service.unsubscribe(subscription)
@@ -3,10 +3,12 @@ from .datetime_service import DatetimeService
 from .user_service import UserService
 from .email_service import EmailService
 from .location_service import LocationService
+from .id_service import IdService
 
 __all__ = (
     'AuthorizationService',
     'DatetimeService',
     'UserService',
     'EmailService',
-    'LocationService')
\ No newline at end of file
+    'LocationService',
+    'IdService')
\ No newline at end of file
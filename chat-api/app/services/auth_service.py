@@ -1,10 +1,10 @@
 import typing as t
+import enum
 import ipinfo
 import sqlalchemy
 import secrets
 import re
 import jwt
-import bcrypt
 import uuid
 import fastapi
 import datetime
@@ -13,29 +13,50 @@ from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from app import error
+from app.cache import TTLCache
 from app.models.errors import ErrorAPIKeyInactive, ErrorAPIKeyInvalid, ErrorAPIKeyMalformed, ErrorEmailCodeExpired, ErrorEmailCodeInvalid, ErrorEmailNotConfirmed, ErrorInvalidPassword, ErrorInvalidPasswordEncoding, ErrorInvalidPasswordFormat, ErrorOAuthInvalidClient, ErrorOAuthInvalidRequest, ErrorOAuthUnauthorizedClient, ErrorUserAlreadyExists, ErrorUserJWTExpired, ErrorUserJWTInvalid, ErrorUserNotFoundID, ErrorUserNotFoundUsername
 from app.models.api_key import SQLAPIKey
 from app.models.user import SQLUser
+from app.models.metrics import CacheStats
+from app.services.password_service import PasswordService
+from app.services.room_service import RoomService
+from app.services.username_autocomplete_service import UsernameAutocompleteService
+from app.services.user_service import UserService
+
+class _APIKeyStatus(enum.Enum):
+    ACTIVE = enum.auto()
+    INACTIVE = enum.auto()
+    INVALID = enum.auto()
+    MALFORMED = enum.auto()
 
 class AuthorizationService:
     def __init__(self,
                  ipinfo_handler: ipinfo.Handler,
                  db_sessionmaker: async_sessionmaker[AsyncSession],
                  min_password_length: int,
-                 password_salt_rounds: int,
+                 password_service: PasswordService,
+                 room_service: RoomService,
+                 username_autocomplete_service: UsernameAutocompleteService,
+                 user_service: UserService,
                  jwt_secret: bytes,
                  jwt_expire_time: datetime.timedelta,
                  email_verification_key: bytes,
-                 email_confirm_code_max_age: int) -> None:
+                 email_confirm_code_max_age: int,
+                 api_key_cache_size: int,
+                 api_key_cache_ttl: float) -> None:
         self._ipinfo_handler = ipinfo_handler
         self._db_sessionmaker = db_sessionmaker
         self._min_password_length = min_password_length
         self._password_validation_regex = re.compile(fr'^(?=.{{{min_password_length},}})(?=.*\d)(?=.*[A-Z])(?=.*[^A-Za-z0-9]).*$')
-        self._password_salt_rounds = password_salt_rounds
+        self._password_service = password_service
+        self._room_service = room_service
+        self._username_autocomplete_service = username_autocomplete_service
+        self._user_service = user_service
         self._jwt_secret = jwt_secret
         self._jwt_expire_time = jwt_expire_time
         self._email_confirm_code_max_age = email_confirm_code_max_age
         self._verification_code_generator = itsdangerous.URLSafeTimedSerializer(email_verification_key)
+        self._api_key_cache = TTLCache[str, _APIKeyStatus](api_key_cache_size, api_key_cache_ttl)
 
     def get_min_password_length(self) -> int:
         return self._min_password_length
@@ -46,28 +67,58 @@ class AuthorizationService:
     def get_jwt_expire_time(self) -> datetime.timedelta:
         return self._jwt_expire_time
 
+    def get_api_key_cache_stats(self) -> CacheStats:
+        return self._api_key_cache.get_stats()
+
     async def validate_api_key(self, api_key: str | uuid.UUID) -> None:
-        if isinstance(api_key, str):
-            try:
-                api_key = uuid.UUID(api_key)
-            except ValueError:
+        '''
+        Checks if provided API key exists and is active. Key status (including unknown and malformed keys)
+        is cached in process, so the database is queried only on cache miss.
+
+        :raises ErrorAPIKeyMalformed: If provided key is not a valid UUID.
+        :raises ErrorAPIKeyInvalid: If provided key does not exist.
+        :raises ErrorAPIKeyInactive: If provided key was deactivated.
+        '''
+
+        cache_key = str(api_key)
+        status = self._api_key_cache.get(cache_key)
+        if status is None:
+            status = await self._fetch_api_key_status(api_key)
+            self._api_key_cache.set(cache_key, status)
+
+        match status:
+            case _APIKeyStatus.MALFORMED:
                 error.raise_error_obj(
                     ErrorAPIKeyMalformed(api_key=api_key),
                     fastapi.status.HTTP_400_BAD_REQUEST)
-            
-        async with self._db_sessionmaker() as db_session:
-            query = sqlalchemy.select(SQLAPIKey.is_active).where(SQLAPIKey.key == api_key)
-            result = await db_session.execute(query)
-            is_active = result.scalar_one_or_none()
+            case _APIKeyStatus.INVALID:
+                ErrorAPIKeyInvalid(api_key=api_key) \
+                    .raise_(fastapi.status.HTTP_404_NOT_FOUND)
+            case _APIKeyStatus.INACTIVE:
+                ErrorAPIKeyInactive(api_key=api_key) \
+                    .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
+
+    async def deactivate_api_key(self, api_key: uuid.UUID) -> None:
+        async with self._db_sessionmaker() as session:
+            query = sqlalchemy.update(SQLAPIKey) \
+                .where(SQLAPIKey.key == api_key) \
+                .values(is_active=False)
+            result = await session.execute(query)
+            if result.rowcount == 0:
+                ErrorAPIKeyInvalid(api_key=api_key) \
+                    .raise_(fastapi.status.HTTP_404_NOT_FOUND)
+
+            await session.commit()
+
+        self.invalidate_api_key(api_key)
+
+    def invalidate_api_key(self, api_key: str | uuid.UUID) -> None:
+        '''
+        Removes cached status of the API key. Must be called whenever key status changes in the database.
+        '''
+
+        self._api_key_cache.invalidate(str(api_key))
 
-        if is_active is None:
-            ErrorAPIKeyInvalid(api_key=api_key) \
-                .raise_(fastapi.status.HTTP_404_NOT_FOUND)
-        
-        if not is_active:
-            ErrorAPIKeyInactive(api_key=api_key) \
-                .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
-            
     # TODO JWT refreshing  
     # def refresh_jwt(self) -> None: ...
 
@@ -84,6 +135,10 @@ class AuthorizationService:
             await session.delete(user)
             await session.commit()
 
+        self._room_service.invalidate_user(user_id)
+        self._username_autocomplete_service.remove_user(user_id)
+        self._user_service.invalidate_user_profile(user_id)
+
     def decode_jwt(self, token: str) -> int:
         '''
         Retrieves user ID from encoded timed JWT. Function uses HS256
@@ -129,7 +184,7 @@ class AuthorizationService:
             ErrorOAuthInvalidClient() \
                 .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
         
-        if not bcrypt.checkpw(password_encoded, result.password_hash):
+        if not await self._password_service.check_password(password_encoded, result.password_hash):
             ErrorOAuthInvalidClient() \
                 .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
             
@@ -183,14 +238,16 @@ class AuthorizationService:
             
             # double check password here to protect from scenario when
             # user has valid JWT stolen and someone tries to change the password
-            if not bcrypt.checkpw(current_password_encoded, user.password_hash):
+            if not await self._password_service.check_password(current_password_encoded, user.password_hash):
                 ErrorInvalidPassword(password=current_password) \
                     .raise_(fastapi.status.HTTP_401_UNAUTHORIZED)
             
-            user.password_hash = self._hash_password(new_password_encoded)
+            user.password_hash = await self._password_service.hash_password(new_password_encoded)
 
             await session.commit()
 
+            self._user_service.invalidate_user_profile(user_id)
+
             # TODO Invalidate JWT (with external function called from endpoint)
 
     async def confirm_user_email(self, confirmation_code: str) -> None:
@@ -219,6 +276,8 @@ class AuthorizationService:
 
             await session.commit()
 
+            self._user_service.invalidate_user_profile(user_id)
+
         return True
 
     async def reset_user_password(self, username: str) -> tuple[str, bytes]:
@@ -240,10 +299,12 @@ class AuthorizationService:
             new_password = secrets.token_hex(8)
 
             # No need to check password encoding here as it is generated by us
-            user.password_hash = self._hash_password(new_password)
+            user.password_hash = await self._password_service.hash_password(new_password.encode('utf-8'))
 
             await session.commit()
 
+            self._user_service.invalidate_user_profile(user.id)
+
             return (user.email, new_password)
     
     async def register_user(self, username: str, email: str, password: str, country_code: str) -> int:
@@ -254,7 +315,7 @@ class AuthorizationService:
                 .raise_(fastapi.status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 
         self._validate_password(password)
-        password_hash = self._hash_password(password_encoded)
+        password_hash = await self._password_service.hash_password(password_encoded)
         
         async with self._db_sessionmaker() as session:
             user = SQLUser(
@@ -274,14 +335,27 @@ class AuthorizationService:
             await session.commit()
             await session.refresh(user)
 
+            self._username_autocomplete_service.add_user(user.id, user.username)
+
             return user.id
     
-    def _hash_password(self, password: bytes):
-        # TODO Possibly move password hashing to coroutine
-        return bcrypt.hashpw(
-            password,
-            bcrypt.gensalt(rounds=self._password_salt_rounds))
-    
+    async def _fetch_api_key_status(self, api_key: str | uuid.UUID) -> _APIKeyStatus:
+        if isinstance(api_key, str):
+            try:
+                api_key = uuid.UUID(api_key)
+            except ValueError:
+                return _APIKeyStatus.MALFORMED
+
+        async with self._db_sessionmaker() as db_session:
+            query = sqlalchemy.select(SQLAPIKey.is_active).where(SQLAPIKey.key == api_key)
+            result = await db_session.execute(query)
+            is_active = result.scalar_one_or_none()
+
+        if is_active is None:
+            return _APIKeyStatus.INVALID
+
+        return _APIKeyStatus.ACTIVE if is_active else _APIKeyStatus.INACTIVE
+
     def _raise_user_not_found(self, user_id: int) -> t.NoReturn:
         error.raise_error_obj(
             ErrorUserNotFoundID(user_id=user_id),
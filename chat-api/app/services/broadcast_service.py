@@ -0,0 +1,97 @@
+import asyncio
+import typing as t
+import pydantic
+
+def room_channel(room_id: int) -> tuple[str, int]:
+    return ('room', room_id)
+
+def presence_channel(user_id: int) -> tuple[str, int]:
+    return ('presence', user_id)
+
+class Subscription:
+    '''
+    Receiving end of one connected client. Events are buffered in a bounded queue and the subscription
+    is dropped as soon as that queue overflows, so a slow consumer never blocks the publisher.
+    '''
+
+    def __init__(self, channels: tuple[t.Hashable, ...], queue_size: int) -> None:
+        self._channels = channels
+        self._queue = asyncio.Queue[str | None](maxsize=queue_size)
+        self._dropped = False
+
+    @property
+    def channels(self) -> tuple[t.Hashable, ...]:
+        return self._channels
+
+    @property
+    def dropped(self) -> bool:
+        return self._dropped
+
+    async def receive(self) -> str | None:
+        '''
+        Waits for the next serialized event. Returns `None` once the subscription was dropped.
+        '''
+
+        return await self._queue.get()
+
+    def _offer(self, data: str) -> bool:
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            self._drop()
+            return False
+
+    def _drop(self) -> None:
+        self._dropped = True
+
+        # discard backlog so the receiver wakes up with the close marker right away
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+        self._queue.put_nowait(None)
+
+class BroadcastService:
+    '''
+    In-process registry of channel subscribers. Each published event is serialized once and fanned out
+    to all subscribers of the channel without awaiting any of them.
+    '''
+
+    def __init__(self, subscriber_queue_size: int) -> None:
+        self._subscriber_queue_size = subscriber_queue_size
+        self._channels = dict[t.Hashable, set[Subscription]]()
+        self._dropped_subscriptions = 0
+
+    def get_dropped_subscriptions_count(self) -> int:
+        return self._dropped_subscriptions
+
+    def subscribe(self, *channels: t.Hashable) -> Subscription:
+        subscription = Subscription(channels, self._subscriber_queue_size)
+        for channel in channels:
+            self._channels.setdefault(channel, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for channel in subscription.channels:
+            subscribers = self._channels.get(channel)
+            if subscribers is None:
+                continue
+
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._channels[channel]
+
+    def has_subscribers(self, channel: t.Hashable) -> bool:
+        return channel in self._channels
+
+    def publish(self, channel: t.Hashable, event: pydantic.BaseModel) -> None:
+        subscribers = self._channels.get(channel)
+        if not subscribers:
+            return
+
+        data = event.model_dump_json()
+        for subscription in tuple(subscribers):
+            if not subscription._offer(data):
+                self._dropped_subscriptions += 1
+                self.unsubscribe(subscription)
@@ -0,0 +1,51 @@
+import asyncio
+import typing as t
+import pydantic
+
+from app.models.event import TypingEvent, PresenceEvent
+from app.models.user import UserActivityStatus
+from app.services.broadcast_service import BroadcastService, room_channel, presence_channel
+
+class EphemeralEventService:
+    '''
+    Publishes high frequency UI signals (typing, presence) to connected subscribers only. Events are never
+    persisted. Each user's signal of a kind is sent at most once per interval, events arriving within
+    the interval are coalesced and only the latest one is sent once it passes.
+    '''
+
+    def __init__(self, broadcast_service: BroadcastService, interval: float) -> None:
+        self._broadcast_service = broadcast_service
+        self._interval = interval
+        # signals sent within the current interval keyed by signal kind and its source,
+        # together with the latest event waiting for the interval to pass
+        self._throttles = dict[t.Hashable, tuple[t.Hashable, pydantic.BaseModel] | None]()
+
+    def publish_typing(self, room_id: int, user_id: int, is_typing: bool) -> None:
+        self._publish(
+            ('typing', room_id, user_id),
+            room_channel(room_id),
+            TypingEvent(room_id=room_id, user_id=user_id, is_typing=is_typing))
+
+    def publish_presence(self, user_id: int, status: UserActivityStatus) -> None:
+        self._publish(
+            ('presence', user_id),
+            presence_channel(user_id),
+            PresenceEvent(user_id=user_id, status=status))
+
+    def _publish(self, key: t.Hashable, channel: t.Hashable, event: pydantic.BaseModel) -> None:
+        if key in self._throttles:
+            # latest state wins, it is sent once the interval passes
+            self._throttles[key] = (channel, event)
+            return
+
+        self._send(key, channel, event)
+
+    def _send(self, key: t.Hashable, channel: t.Hashable, event: pydantic.BaseModel) -> None:
+        self._broadcast_service.publish(channel, event)
+        self._throttles[key] = None
+        asyncio.get_running_loop().call_later(self._interval, self._flush, key)
+
+    def _flush(self, key: t.Hashable) -> None:
+        pending = self._throttles.pop(key)
+        if pending is not None:
+            self._send(key, *pending)
@@ -0,0 +1,41 @@
+import time
+
+# 2024-01-01T00:00:00Z, gives the 41 bit timestamp about 69 years of range
+_EPOCH_MS = 1704067200000
+# IDs are sent as JSON numbers, so together with the timestamp they must fit in 53 bits
+# to be represented exactly by JavaScript clients
+_WORKER_ID_BITS = 4
+_SEQUENCE_BITS = 8
+_MAX_WORKER_ID = (1 << _WORKER_ID_BITS) - 1
+_MAX_SEQUENCE = (1 << _SEQUENCE_BITS) - 1
+
+class IdService:
+    '''
+    Generates unique, time ordered 53 bit IDs (snowflake layout): milliseconds since epoch,
+    followed by worker ID and a per millisecond sequence number. Every API instance writing
+    to the same database must be configured with a distinct worker ID.
+    '''
+
+    def __init__(self, worker_id: int) -> None:
+        assert 0 <= worker_id <= _MAX_WORKER_ID, f'Worker ID must be between 0 and {_MAX_WORKER_ID}'
+
+        self._worker_id = worker_id
+        self._last_timestamp = 0
+        self._sequence = 0
+
+    def generate(self) -> int:
+        timestamp = time.time_ns() // 1_000_000 - _EPOCH_MS
+        if timestamp > self._last_timestamp:
+            self._last_timestamp = timestamp
+            self._sequence = 0
+        else:
+            # clock went backwards or sequence is exhausted, keep counting from the last timestamp
+            # instead of blocking the event loop until the clock catches up
+            self._sequence += 1
+            if self._sequence > _MAX_SEQUENCE:
+                self._last_timestamp += 1
+                self._sequence = 0
+
+        return (self._last_timestamp << (_WORKER_ID_BITS + _SEQUENCE_BITS)) \
+            | (self._worker_id << _SEQUENCE_BITS) \
+            | self._sequence
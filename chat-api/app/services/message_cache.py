@@ -0,0 +1,145 @@
+import collections
+
+from app.models.message import RoomMessageRow
+from app.models.metrics import CacheStats
+
+class _RoomBuffer:
+    def __init__(self, messages: list[RoomMessageRow], room_size: int, complete: bool) -> None:
+        # messages are kept from the oldest to the newest
+        self.messages = collections.deque[RoomMessageRow](messages, maxlen=room_size)
+        self.complete = complete
+
+class RoomMessageCache:
+    '''
+    Keeps the most recent messages of recently read rooms in memory. Rooms are loaded lazily on first read
+    and then kept up to date by the message writer after every commit. Total number of cached messages
+    is capped and the least recently read rooms are evicted first. Every room takes up one more slot
+    of the cap, so rooms without messages are evicted as well.
+    '''
+
+    def __init__(self, room_size: int, max_messages: int) -> None:
+        self._room_size = room_size
+        self._max_messages = max_messages
+        self._rooms = collections.OrderedDict[int, _RoomBuffer]()
+        self._cached_messages = 0
+        # rooms being loaded from the database, with a counter of commits that happened meanwhile
+        self._loading = dict[int, list[int]]()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def room_size(self) -> int:
+        return self._room_size
+
+    def get_stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            size=self._cached_messages,
+            max_size=self._max_messages)
+
+    def is_tracked(self, room_id: int) -> bool:
+        return room_id in self._rooms or room_id in self._loading
+
+    def get_latest(self, room_id: int, limit: int) -> list[RoomMessageRow] | None:
+        '''
+        Returns up to `limit` newest messages of the room ordered from the newest
+        or `None` if they cannot be served from the cache.
+        '''
+
+        room = self._rooms.get(room_id)
+        if room is None or (limit > len(room.messages) and not room.complete):
+            self._misses += 1
+            return None
+
+        self._rooms.move_to_end(room_id)
+        self._hits += 1
+
+        messages = list[RoomMessageRow]()
+        for message in reversed(room.messages):
+            if len(messages) >= limit:
+                break
+
+            messages.append(message)
+
+        return messages
+
+    def start_load(self, room_id: int) -> int:
+        '''
+        Marks room as being loaded from the database. Returned generation has to be passed to `finish_load`.
+        '''
+
+        loading = self._loading.setdefault(room_id, [0, 0])
+        loading[0] += 1
+
+        return loading[1]
+
+    def finish_load(self, room_id: int, generation: int, messages: list[RoomMessageRow] | None) -> None:
+        '''
+        Installs messages loaded from the database (ordered from the newest). Messages are discarded if any
+        commit for the room happened while they were loaded, as they might not be the newest anymore.
+        Pass `None` if loading failed.
+        '''
+
+        loading = self._loading[room_id]
+        loading[0] -= 1
+        if loading[0] == 0:
+            del self._loading[room_id]
+
+        if messages is None or loading[1] != generation:
+            return
+
+        self._remove_room(room_id)
+        self._rooms[room_id] = _RoomBuffer(
+            reversed(messages),
+            self._room_size,
+            complete=len(messages) < self._room_size)
+        self._cached_messages += len(self._rooms[room_id].messages)
+        self._evict()
+
+    def append(self, room_id: int, messages: list[RoomMessageRow]) -> None:
+        '''
+        Adds committed messages (ordered from the oldest) to the room if it is cached.
+        '''
+
+        loading = self._loading.get(room_id)
+        if loading is not None:
+            loading[1] += 1
+
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+
+        for message in messages:
+            if len(room.messages) == room.messages.maxlen:
+                room.complete = False
+                self._cached_messages -= 1
+
+            room.messages.append(message)
+            self._cached_messages += 1
+
+        self._evict()
+
+    def invalidate_room(self, room_id: int) -> None:
+        self._remove_room(room_id)
+
+        loading = self._loading.get(room_id)
+        if loading is not None:
+            loading[1] += 1
+
+    def clear(self) -> None:
+        self._rooms.clear()
+        self._cached_messages = 0
+
+        for loading in self._loading.values():
+            loading[1] += 1
+
+    def _remove_room(self, room_id: int) -> None:
+        room = self._rooms.pop(room_id, None)
+        if room is not None:
+            self._cached_messages -= len(room.messages)
+
+    def _evict(self) -> None:
+        while self._cached_messages + len(self._rooms) > self._max_messages and self._rooms:
+            _, room = self._rooms.popitem(last=False)
+            self._cached_messages -= len(room.messages)
@@ -0,0 +1,217 @@
+import os
+import zlib
+import enum
+import struct
+import typing as t
+import asyncio
+import pathlib
+
+from app.models.message import MessageIncoming
+
+# every record is prefixed with payload length and its CRC32, so torn writes at the tail can be detected
+_RECORD_HEADER = struct.Struct('<II')
+_SEGMENT_SUFFIX = '.log'
+
+class FsyncPolicy(enum.StrEnum):
+    MESSAGE = 'MESSAGE'
+    '''
+    Every message is synced to disk on its own before it is acknowledged.
+    '''
+
+    BATCH = 'BATCH'
+    '''
+    Messages appended concurrently share a single sync (group commit) before they are acknowledged.
+    '''
+
+    INTERVAL = 'INTERVAL'
+    '''
+    Log is synced periodically, messages are acknowledged before they reach the disk.
+    '''
+
+class _Segment:
+    def __init__(self, segment_id: int, path: pathlib.Path) -> None:
+        self.id = segment_id
+        self.path = path
+        self.file = path.open('ab')
+        self.size = self.file.tell()
+        self.pending = 0
+        self.sealed = False
+
+class MessageLog:
+    '''
+    Append-only log of messages accepted but not yet committed to the database. Log is split into
+    segments, which are removed once all of their messages were committed or rejected. Segments left behind
+    by a crash are replayed on startup.
+    '''
+
+    def __init__(self,
+                 directory: pathlib.Path,
+                 fsync_policy: FsyncPolicy,
+                 fsync_interval: float,
+                 segment_size: int) -> None:
+        self._directory = directory
+        self._fsync_policy = fsync_policy
+        self._fsync_interval = fsync_interval
+        self._segment_size = segment_size
+        self._segments = dict[int, _Segment]()
+        self._current: _Segment | None = None
+        self._sync_lock = asyncio.Lock()
+        self._group_sync: asyncio.Future | None = None
+        self._interval_sync_task: asyncio.Task | None = None
+        self._recovered_paths = list[pathlib.Path]()
+
+        if not self._directory.exists():
+            os.makedirs(self._directory)
+
+    def recover(self) -> list[MessageIncoming]:
+        '''
+        Reads messages from segments left by the previous run. Segment files are kept until
+        `discard_recovered` is called, after replayed messages were committed.
+        '''
+
+        messages = list[MessageIncoming]()
+        self._recovered_paths = sorted(self._directory.glob(f'*{_SEGMENT_SUFFIX}'), key=_get_segment_id)
+        for path in self._recovered_paths:
+            messages.extend(_read_segment(path))
+
+        return messages
+
+    def discard_recovered(self) -> None:
+        for path in self._recovered_paths:
+            path.unlink(missing_ok=True)
+
+        self._recovered_paths.clear()
+
+    def start(self) -> None:
+        assert self._current is None, 'Message log already started'
+
+        next_id = max((_get_segment_id(x) for x in self._directory.glob(f'*{_SEGMENT_SUFFIX}')), default=0) + 1
+        self._open_segment(next_id)
+
+        if self._fsync_policy == FsyncPolicy.INTERVAL:
+            self._interval_sync_task = asyncio.create_task(self._interval_sync())
+
+    async def close(self) -> None:
+        if self._interval_sync_task is not None:
+            self._interval_sync_task.cancel()
+            await asyncio.gather(self._interval_sync_task, return_exceptions=True)
+            self._interval_sync_task = None
+
+        async with self._sync_lock:
+            segment = self._current
+            if segment is not None and not segment.sealed:
+                await asyncio.to_thread(os.fsync, segment.file.fileno())
+                self._seal_segment(segment)
+
+        self._current = None
+
+    async def append(self, message: MessageIncoming) -> int:
+        '''
+        Appends message to the log and makes it durable according to the fsync policy.
+        Returns ID of the segment which has to be passed to `release` once message is committed.
+        '''
+
+        assert self._current is not None, 'Message log not started'
+
+        payload = message.model_dump_json().encode('utf-8')
+        segment = self._current
+        segment.file.write(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        segment.file.write(payload)
+        # push record to the OS right away, so it survives a process crash regardless of fsync policy
+        segment.file.flush()
+        segment.size += _RECORD_HEADER.size + len(payload)
+        segment.pending += 1
+
+        match self._fsync_policy:
+            case FsyncPolicy.MESSAGE:
+                await self._sync_segment(segment)
+            case FsyncPolicy.BATCH:
+                await self._sync_group(segment)
+
+        if segment is self._current and segment.size >= self._segment_size:
+            await self._rotate()
+
+        return segment.id
+
+    def release(self, segment_id: int) -> None:
+        '''
+        Marks one message of the segment as committed. Sealed segments are removed once
+        all of their messages were released.
+        '''
+
+        segment = self._segments.get(segment_id)
+        if segment is None:
+            return
+
+        segment.pending -= 1
+        if segment.sealed and segment.pending <= 0:
+            self._remove_segment(segment)
+
+    async def _sync_group(self, segment: _Segment) -> None:
+        if self._group_sync is None:
+            self._group_sync = asyncio.ensure_future(self._run_group_sync(segment))
+
+        await asyncio.shield(self._group_sync)
+
+    async def _run_group_sync(self, segment: _Segment) -> None:
+        # give concurrent appenders a chance to join this sync
+        await asyncio.sleep(0)
+
+        # records appended from now on have to wait for the next sync
+        self._group_sync = None
+        await self._sync_segment(segment)
+
+    async def _sync_segment(self, segment: _Segment) -> None:
+        async with self._sync_lock:
+            if not segment.file.closed:
+                await asyncio.to_thread(os.fsync, segment.file.fileno())
+
+    async def _interval_sync(self) -> None:
+        while True:
+            await asyncio.sleep(self._fsync_interval)
+            if self._current is not None:
+                await self._sync_segment(self._current)
+
+    async def _rotate(self) -> None:
+        async with self._sync_lock:
+            segment = self._current
+            if segment.size < self._segment_size:
+                # already rotated by concurrent append
+                return
+
+            # records appended during the fsync go to the new segment, so the old one is complete once synced
+            self._open_segment(segment.id + 1)
+            await asyncio.to_thread(os.fsync, segment.file.fileno())
+            self._seal_segment(segment)
+
+    def _open_segment(self, segment_id: int) -> None:
+        segment = _Segment(segment_id, self._directory / f'{segment_id:016d}{_SEGMENT_SUFFIX}')
+        self._segments[segment_id] = segment
+        self._current = segment
+
+    def _seal_segment(self, segment: _Segment) -> None:
+        segment.sealed = True
+        segment.file.close()
+
+        if segment.pending <= 0:
+            self._remove_segment(segment)
+
+    def _remove_segment(self, segment: _Segment) -> None:
+        del self._segments[segment.id]
+        segment.path.unlink(missing_ok=True)
+
+def _get_segment_id(path: pathlib.Path) -> int:
+    return int(path.stem)
+
+def _read_segment(path: pathlib.Path) -> t.Iterator[MessageIncoming]:
+    data = path.read_bytes()
+    offset = 0
+    while offset + _RECORD_HEADER.size <= len(data):
+        length, checksum = _RECORD_HEADER.unpack_from(data, offset)
+        payload = data[offset + _RECORD_HEADER.size:offset + _RECORD_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            # torn write at the tail, nothing after it could have been acknowledged
+            break
+
+        yield MessageIncoming.model_validate_json(payload)
+        offset += _RECORD_HEADER.size + length
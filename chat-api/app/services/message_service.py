@@ -1,80 +1,609 @@
+import enum
+import time
 import asyncio
+import collections
+import typing as t
 import sqlalchemy
-from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
-from sqlalchemy.exc import IntegrityError
-from app.models.message import MessageIncoming, SQLMessage
+import sqlalchemy.exc
+import fastapi
+from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
+from app.error import Error
+from app.models.message import MessageIncoming, SQLMessage, RoomMessageRow
+from app.models.user import SQLUser
+from app.models.chat_room import SQLChatRoom
+from app.models.errors import ErrorDatabaseFail, ErrorMessageRejected, ErrorMessageQueueFull
+from app.models.event import MessageEvent, MessageRejectedEvent
+from app.models.metrics import MessageWriterStats, MessageBatchingStats
+from app.services.broadcast_service import BroadcastService, room_channel
+from app.services.message_log import MessageLog
+from app.services.message_cache import RoomMessageCache
+from app.services.unread_counter_service import UnreadCounterService
+
+_INSERT_LATENCY_SMOOTHING = 0.2
+_RETRY_AFTER_SECONDS = 1
+_WRITER_RESTART_DELAY = 1.0
+
+class OverflowPolicy(enum.StrEnum):
+    BLOCK = 'BLOCK'
+    '''
+    Wait for free space in the writer queue, but not longer than configured deadline.
+    '''
+
+    REJECT = 'REJECT'
+    '''
+    Reject message with 503 right away.
+    '''
+
+    SPILL = 'SPILL'
+    '''
+    Put message into secondary buffer, which is drained into the writer queue as space frees up.
+    Messages are rejected only once that buffer is full as well.
+    '''
+
+class FlushReason(enum.StrEnum):
+    SIZE = 'SIZE'
+    LINGER = 'LINGER'
+    SHUTDOWN = 'SHUTDOWN'
+
+class _AdaptiveBatchPolicy:
+    '''
+    Picks writer batch size and linger time based on queue depth and observed INSERT latency.
+    Backlog grows the batch size and removes linger, while idle writers shrink batches and
+    wait only about as long as a single INSERT takes, so a lone message is not held back.
+    '''
+
+    def __init__(self,
+                 min_batch_size: int,
+                 max_batch_size: int,
+                 min_linger: float,
+                 max_linger: float) -> None:
+        assert 0 < min_batch_size <= max_batch_size, 'Invalid batch size bounds'
+        assert 0.0 <= min_linger <= max_linger, 'Invalid linger time bounds'
+
+        self._min_batch_size = min_batch_size
+        self._max_batch_size = max_batch_size
+        self._min_linger = min_linger
+        self._max_linger = max_linger
+        self._insert_latency: float | None = None
+        self._batch_size_histogram = collections.Counter[int]()
+        self._flush_reasons = collections.Counter[FlushReason]()
+
+        self.batch_size = min_batch_size
+        self.linger = min_linger
+
+    def record_flush(self,
+                     batch_size: int,
+                     reason: FlushReason,
+                     insert_latency: float,
+                     queue_depth: int) -> None:
+        # histogram buckets are powers of two, keyed by their upper bound
+        self._batch_size_histogram[1 << (batch_size - 1).bit_length()] += 1
+        self._flush_reasons[reason] += 1
+
+        if self._insert_latency is None:
+            self._insert_latency = insert_latency
+        else:
+            self._insert_latency += _INSERT_LATENCY_SMOOTHING * (insert_latency - self._insert_latency)
+
+        if queue_depth >= self.batch_size or (reason == FlushReason.SIZE and queue_depth > 0):
+            self.batch_size = min(self.batch_size * 2, self._max_batch_size)
+        elif reason == FlushReason.LINGER and batch_size < self.batch_size // 2:
+            self.batch_size = max(self.batch_size // 2, self._min_batch_size)
+
+        if queue_depth > 0:
+            # there is a backlog already, waiting for more messages only adds latency
+            self.linger = self._min_linger
+        else:
+            self.linger = min(max(self._insert_latency, self._min_linger), self._max_linger)
+
+    def get_stats(self) -> MessageBatchingStats:
+        return MessageBatchingStats(
+            batch_size=self.batch_size,
+            linger=self.linger,
+            insert_latency=self._insert_latency,
+            batch_size_histogram=dict(sorted(self._batch_size_histogram.items())),
+            flush_reasons=dict(self._flush_reasons))
+
+class _QueuedMessage:
+    def __init__(self, message: MessageIncoming) -> None:
+        self.message = message
+        self.outcome = asyncio.get_running_loop().create_future()
+        self.log_segment: int | None = None
+
+class _MessageWriter:
+    def __init__(self, message_queue_size: int, batch_policy: _AdaptiveBatchPolicy) -> None:
+        self.queue = asyncio.Queue[_QueuedMessage](maxsize=message_queue_size)
+        self.spill = collections.deque[_QueuedMessage]()
+        # held by messages waiting for free space in the queue, so they are queued in order of arrival
+        self.put_lock = asyncio.Lock()
+        # messages already taken from the queue for the batch being collected
+        self.batch = list[_QueuedMessage]()
+        self.batch_policy = batch_policy
+        self.task: asyncio.Task | None = None
+        self.queue_high_water_mark = 0
+        self.messages_spilled = 0
+        self.messages_overflowed = 0
+        self.messages_written = 0
+        self.messages_rejected = 0
+        self.batches_written = 0
+
+    def record_queue_depth(self) -> None:
+        self.queue_high_water_mark = max(self.queue_high_water_mark, self.queue.qsize() + len(self.spill))
+
+    def refill_from_spill(self) -> None:
+        while self.spill and not self.queue.full():
+            self.queue.put_nowait(self.spill.popleft())
+
+    def get_stats(self) -> MessageWriterStats:
+        return MessageWriterStats(
+            queue_size=self.queue.qsize(),
+            queue_high_water_mark=self.queue_high_water_mark,
+            spill_size=len(self.spill),
+            messages_spilled=self.messages_spilled,
+            messages_overflowed=self.messages_overflowed,
+            messages_written=self.messages_written,
+            messages_rejected=self.messages_rejected,
+            batches_written=self.batches_written,
+            batching=self.batch_policy.get_stats())
 
 class MessageService:
     def __init__(self,
-                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 db_engine: AsyncEngine,
+                 broadcast_service: BroadcastService,
+                 message_log: MessageLog | None,
+                 message_cache: RoomMessageCache,
+                 unread_counter_service: UnreadCounterService,
                  db_writer_tasks: int,
                  message_queue_size: int,
-                 message_upload_batch_size: int,
-                 message_upload_batch_timeout: float) -> None:
-        self._db_sessionmaker = db_sessionmaker
-        self._message_upload_batch_size = message_upload_batch_size
-        self._message_upload_batch_timeout = message_upload_batch_timeout
-        self._message_queue = asyncio.Queue[MessageIncoming](maxsize=message_queue_size)
-        self._db_writer_task: asyncio.Task | None = None
-
-    def start_db_writer_task(self) -> None:
-        assert self._db_writer_task is None, 'Writer task already running'
-        self._db_writer_task = asyncio.create_task(self._db_writer())
-
-    async def shutdown_db_writer_task(self) -> None:
-        if self._db_writer_task is not None:
-            self._db_writer_task.cancel()
-            await self._db_writer_task
-
-            self._db_writer_task = None
-    
-    async def upload_message(self, message: MessageIncoming) -> None:
-        await self._message_queue.put(message)
-
-    async def _db_writer(self):
+                 overflow_policy: OverflowPolicy,
+                 overflow_block_timeout: float,
+                 overflow_spill_size: int,
+                 min_batch_size: int,
+                 max_batch_size: int,
+                 min_batch_linger: float,
+                 max_batch_linger: float) -> None:
+        assert db_writer_tasks > 0, 'At least one writer task is required'
+
+        self._db_engine = db_engine
+        self._broadcast_service = broadcast_service
+        self._message_log = message_log
+        self._message_cache = message_cache
+        self._unread_counter_service = unread_counter_service
+        self._max_batch_size = max_batch_size
+        self._overflow_policy = overflow_policy
+        self._overflow_block_timeout = overflow_block_timeout
+        self._overflow_spill_size = overflow_spill_size
+        # queued messages not yet committed, per room in the order of acceptance
+        self._pending_messages = dict[int, dict[_QueuedMessage, None]]()
+        self._writers = [
+            _MessageWriter(
+                message_queue_size,
+                _AdaptiveBatchPolicy(min_batch_size, max_batch_size, min_batch_linger, max_batch_linger))
+            for _ in range(db_writer_tasks)]
+
+    def get_writer_stats(self) -> list[MessageWriterStats]:
+        return [x.get_stats() for x in self._writers]
+
+    def get_pending_messages(self, room_id: int) -> list[MessageIncoming]:
+        '''
+        Returns messages accepted for the room, which are not committed yet, ordered from the newest.
+        '''
+
+        pending = self._pending_messages.get(room_id)
+        if pending is None:
+            return []
+
+        return [x.message for x in reversed(pending)]
+
+    async def recover_logged_messages(self) -> int:
+        '''
+        Stores messages left in the message log by the previous run. Must be called before writer tasks are started.
+        Returns number of recovered messages.
+        '''
+
+        if self._message_log is None:
+            return 0
+
+        messages = await asyncio.to_thread(self._message_log.recover)
+
+        shards = {id(x): list[_QueuedMessage]() for x in self._writers}
+        for message in messages:
+            shards[id(self._get_writer(message.room_id))].append(_QueuedMessage(message))
+
+        async with self._db_engine.connect() as connection:
+            for writer in self._writers:
+                items = shards[id(writer)]
+                for i in range(0, len(items), self._max_batch_size):
+                    # messages stored before the previous run stopped must not be counted or cached again
+                    batch = await self._skip_stored_messages(connection, items[i:i + self._max_batch_size])
+                    if batch:
+                        await self._insert_isolating_failures(writer, connection, batch, skip_existing=True)
+
+        self._message_log.discard_recovered()
+
+        return len(messages)
+
+    async def _skip_stored_messages(self,
+                                    connection: AsyncConnection,
+                                    batch: list[_QueuedMessage]) -> list[_QueuedMessage]:
+        query = sqlalchemy.select(SQLMessage.id) \
+            .where(SQLMessage.id.in_([x.message.id for x in batch]))
+        stored_ids = set((await connection.execute(query)).scalars().all())
+        await connection.rollback()
+
+        return [x for x in batch if x.message.id not in stored_ids]
+
+    def start_db_writer_tasks(self) -> None:
+        if self._message_log is not None:
+            self._message_log.start()
+
+        for writer in self._writers:
+            assert writer.task is None, 'Writer task already running'
+            writer.task = asyncio.create_task(self._db_writer(writer))
+
+    async def shutdown_db_writer_tasks(self) -> None:
+        tasks = [x.task for x in self._writers if x.task is not None]
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for writer in self._writers:
+            writer.task = None
+
+        if self._message_log is not None:
+            await self._message_log.close()
+
+    async def upload_message(self, message: MessageIncoming) -> asyncio.Future[Error | None]:
+        '''
+        Queues message to be stored by the database writer. Returned future resolves once the message
+        batch is written, either to `None` if message was stored or to the error that caused its rejection.
+        Rejected messages are dropped and `MessageRejectedEvent` is published for them.
+
+        :raises ErrorMessageQueueFull: If writer is overloaded and message cannot be accepted according to the overflow policy.
+        '''
+
+        writer = self._get_writer(message.room_id)
+        # fail fast before the message is logged if it would be rejected anyway
+        self._ensure_capacity(writer)
+
+        item = _QueuedMessage(message)
+        if self._message_log is not None:
+            item.log_segment = await self._message_log.append(message)
+
         try:
-            while True:
-                batch = list[MessageIncoming]()
+            await self._enqueue(writer, item)
+        except BaseException:
+            # message was not accepted, so it must not be replayed either
+            self._release_logged_message(item)
+            raise
+
+        if not item.outcome.done():
+            self._pending_messages.setdefault(message.room_id, {})[item] = None
+
+        self._broadcast_service.publish(
+            room_channel(message.room_id),
+            MessageEvent(message=message))
+
+        return item.outcome
+
+    def _ensure_capacity(self, writer: _MessageWriter) -> None:
+        match self._overflow_policy:
+            case OverflowPolicy.REJECT:
+                if writer.queue.full():
+                    self._raise_queue_full(writer)
+            case OverflowPolicy.SPILL:
+                if writer.queue.full() and len(writer.spill) >= self._overflow_spill_size:
+                    self._raise_queue_full(writer)
+
+    async def _enqueue(self, writer: _MessageWriter, item: _QueuedMessage) -> None:
+        # once anything got spilled or blocked new messages have to go after it to keep per-room order
+        if not writer.spill and not writer.put_lock.locked() and not writer.queue.full():
+            writer.queue.put_nowait(item)
+            writer.record_queue_depth()
+            return
+
+        match self._overflow_policy:
+            case OverflowPolicy.BLOCK:
+                try:
+                    await asyncio.wait_for(self._put_in_order(writer, item), self._overflow_block_timeout)
+                except asyncio.TimeoutError:
+                    self._raise_queue_full(writer)
+            case OverflowPolicy.SPILL:
+                if len(writer.spill) >= self._overflow_spill_size:
+                    self._raise_queue_full(writer)
+
+                writer.spill.append(item)
+                writer.messages_spilled += 1
+            case _:
+                self._raise_queue_full(writer)
 
-                item = await self._message_queue.get()
-                batch.append(item)
+        writer.record_queue_depth()
 
-                deadline = asyncio.get_event_loop().time() + self._message_upload_batch_timeout
+    async def _put_in_order(self, writer: _MessageWriter, item: _QueuedMessage) -> None:
+        # lock is fair, while a freed slot would otherwise go to whichever message asks for it first
+        async with writer.put_lock:
+            await writer.queue.put(item)
 
-                while len(batch) < self._message_upload_batch_size:
-                    timeout = deadline - asyncio.get_event_loop().time()
-                    if timeout <= 0.0:
-                        break
+    def _raise_queue_full(self, writer: _MessageWriter) -> t.NoReturn:
+        writer.messages_overflowed += 1
+        ErrorMessageQueueFull() \
+            .raise_(fastapi.status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': str(_RETRY_AFTER_SECONDS)})
 
+    def _get_writer(self, room_id: int) -> _MessageWriter:
+        # messages of a single room always go through the same writer to keep their order
+        return self._writers[room_id % len(self._writers)]
+
+    async def _db_writer(self, writer: _MessageWriter):
+        while True:
+            try:
+                # each writer keeps its own connection, so batches of different shards are inserted in parallel
+                async with self._db_engine.connect() as connection:
                     try:
-                        item = await asyncio.wait_for(self._message_queue.get(), timeout)
-                        batch.append(item)
-                    except asyncio.TimeoutError:
-                        break
-                
-                await asyncio.shield(self._upload_message_batch(batch))
-        except asyncio.CancelledError:
-            await self._flush_remaining_messages()
-            raise
+                        while True:
+                            batch, reason = await self._collect_batch(writer)
+                            writer.batch = []
+                            await self._write_batch(writer, connection, batch, reason)
+                    except asyncio.CancelledError:
+                        try:
+                            await self._flush_remaining_messages(writer, connection)
+                        except Exception as e:
+                            print(e)
+
+                        raise
+            except Exception as e:
+                # failed batch is resolved already, writer starts over with a new connection in case
+                # the old one is broken, instead of leaving its shard without a writer
+                print(e)
+                await asyncio.sleep(_WRITER_RESTART_DELAY)
+
+    async def _collect_batch(self, writer: _MessageWriter) -> tuple[list[_QueuedMessage], FlushReason]:
+        # batch is kept on the writer, so messages collected so far are flushed if it is cancelled meanwhile
+        batch = writer.batch
+        batch.append(await writer.queue.get())
+        writer.refill_from_spill()
+
+        deadline = asyncio.get_running_loop().time() + writer.batch_policy.linger
+
+        while len(batch) < writer.batch_policy.batch_size:
+            if writer.queue.empty():
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0.0:
+                    return (batch, FlushReason.LINGER)
+
+                try:
+                    batch.append(await asyncio.wait_for(writer.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    return (batch, FlushReason.LINGER)
+            else:
+                batch.append(writer.queue.get_nowait())
+
+            writer.refill_from_spill()
+
+        return (batch, FlushReason.SIZE)
+
+    async def _flush_remaining_messages(self, writer: _MessageWriter, connection: AsyncConnection):
+        items = writer.batch
+        writer.batch = []
+        while not writer.queue.empty():
+            items.append(writer.queue.get_nowait())
+
+        items.extend(writer.spill)
+        writer.spill.clear()
 
-    async def _flush_remaining_messages(self):
-        items = list[MessageIncoming]()
-        while not self._message_queue.empty():
-            items.append(self._message_queue.get_nowait())
-        
         if len(items) > 0:
-            await asyncio.shield(self._upload_message_batch(items))
-    
-    async def _upload_message_batch(self, batch: list[MessageIncoming]) -> None:
-        async with self._db_sessionmaker() as session:
-            query = sqlalchemy.insert(SQLMessage).values([x.model_dump() for x in batch])
-            await session.execute(query)
+            await self._write_batch(writer, connection, items, FlushReason.SHUTDOWN)
 
-            try:
-                await session.commit()
-            except IntegrityError as e:
-                await session.rollback()
+    async def _write_batch(self,
+                           writer: _MessageWriter,
+                           connection: AsyncConnection,
+                           batch: list[_QueuedMessage],
+                           reason: FlushReason) -> None:
+        start_time = time.perf_counter()
+        await self._upload_message_batch_shielded(writer, connection, batch)
+
+        writer.batch_policy.record_flush(
+            len(batch),
+            reason,
+            time.perf_counter() - start_time,
+            writer.queue.qsize() + len(writer.spill))
 
+    async def _upload_message_batch_shielded(self,
+                                             writer: _MessageWriter,
+                                             connection: AsyncConnection,
+                                             batch: list[_QueuedMessage]) -> None:
+        upload = asyncio.ensure_future(self._upload_message_batch(writer, connection, batch))
+        try:
+            await asyncio.shield(upload)
+        except asyncio.CancelledError:
+            # let the batch finish before the connection is reused to flush remaining messages
+            try:
+                await upload
+            except Exception as e:
                 print(e)
-                # TODO Check which message caused error, remove it and send info to the client that posted it
-                pass
+
+            raise
+
+    async def _upload_message_batch(self,
+                                    writer: _MessageWriter,
+                                    connection: AsyncConnection,
+                                    batch: list[_QueuedMessage]) -> None:
+        try:
+            await self._insert_isolating_failures(writer, connection, batch)
+        except Exception:
+            # part of the batch may have been committed and resolved before the failure
+            failed = [x for x in batch if not x.outcome.done()]
+            for item in failed:
+                self._resolve(item, ErrorDatabaseFail())
+
+            writer.messages_rejected += len(failed)
+            raise
+
+        writer.batches_written += 1
+
+    async def _insert_isolating_failures(self,
+                                         writer: _MessageWriter,
+                                         connection: AsyncConnection,
+                                         batch: list[_QueuedMessage],
+                                         skip_existing: bool = False) -> None:
+        '''
+        Inserts whole batch with a single statement. If any row violates constraints (e.g. room was deleted
+        or content is too long) the batch is split in halves and retried, until failing messages are isolated.
+        All valid messages are committed, in their original order.
+
+        Messages which IDs are already stored are rejected, unless `skip_existing` is set, in which case they
+        are left as they are. It is meant only for messages replayed from the log, which may have been stored
+        before the previous run stopped.
+        '''
+
+        if skip_existing:
+            query = mysql.insert(SQLMessage).values([x.message.model_dump() for x in batch])
+            query = query.on_duplicate_key_update(id=query.inserted.id)
+        else:
+            query = sqlalchemy.insert(SQLMessage).values([x.message.model_dump() for x in batch])
+
+        try:
+            await connection.execute(query)
+            await self._update_last_room_messages(connection, batch)
+            await connection.commit()
+        except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.DataError) as e:
+            await connection.rollback()
+
+            if len(batch) == 1:
+                item = batch[0]
+                self._resolve(item, ErrorMessageRejected(room_id=item.message.room_id, reason=str(e.orig)))
+                writer.messages_rejected += 1
+                return
+
+            middle = len(batch) // 2
+            await self._insert_isolating_failures(writer, connection, batch[:middle], skip_existing)
+            await self._insert_isolating_failures(writer, connection, batch[middle:], skip_existing)
+            return
+
+        # counted in before anything else is awaited, so a read marker moved in the meantime
+        # cannot recount the messages from the database as well
+        self._unread_counter_service.record_messages(x.message for x in batch)
+
+        usernames = await self._get_cached_sender_usernames(connection, batch)
+
+        # messages are moved to the cache and out of pending ones at once, so readers never miss them
+        self._cache_committed_messages(batch, usernames)
+        for item in batch:
+            self._resolve(item, None)
+
+        writer.messages_written += len(batch)
+
+    async def _update_last_room_messages(self, connection: AsyncConnection, batch: list[_QueuedMessage]) -> None:
+        newest_messages = dict[int, MessageIncoming]()
+        for item in batch:
+            message = item.message
+            newest = newest_messages.get(message.room_id)
+            if newest is None or newest.id < message.id:
+                newest_messages[message.room_id] = message
+
+        # condition on the current pointer keeps it from moving backwards (e.g. when the log is replayed)
+        query = sqlalchemy.update(SQLChatRoom) \
+            .where(
+                SQLChatRoom.id == sqlalchemy.bindparam('b_room_id'),
+                sqlalchemy.or_(
+                    SQLChatRoom.last_message_id.is_(None),
+                    SQLChatRoom.last_message_id < sqlalchemy.bindparam('b_id'))) \
+            .values(
+                last_message_id=sqlalchemy.bindparam('b_id'),
+                last_message_type=sqlalchemy.bindparam('b_type'),
+                last_message_content=sqlalchemy.bindparam('b_content'),
+                last_message_sent_at=sqlalchemy.bindparam('b_sent_at'),
+                last_message_sender_id=sqlalchemy.bindparam('b_sender_id'))
+        await connection.execute(
+            query,
+            [
+                {
+                    'b_room_id': x.room_id,
+                    'b_id': x.id,
+                    'b_type': x.type,
+                    'b_content': x.content,
+                    'b_sent_at': x.sent_at,
+                    'b_sender_id': x.sender_id,
+                }
+                for x
+                in newest_messages.values()])
+
+    async def _get_cached_sender_usernames(self,
+                                           connection: AsyncConnection,
+                                           batch: list[_QueuedMessage]) -> dict[int, str]:
+        sender_ids = {
+            x.message.sender_id
+            for x
+            in batch
+            if self._message_cache.is_tracked(x.message.room_id)}
+        if not sender_ids:
+            return {}
+
+        query = sqlalchemy.select(SQLUser.id, SQLUser.username) \
+            .where(SQLUser.id.in_(sender_ids))
+        try:
+            usernames = dict((await connection.execute(query)).tuples().all())
+            await connection.rollback()
+        except sqlalchemy.exc.DBAPIError as e:
+            # messages are already committed, affected rooms will be reloaded on the next read instead
+            await connection.rollback()
+            print(e)
+
+            for item in batch:
+                self._message_cache.invalidate_room(item.message.room_id)
+
+            return {}
+
+        return usernames
+
+    def _cache_committed_messages(self,
+                                  batch: list[_QueuedMessage],
+                                  usernames: dict[int, str]) -> None:
+        rooms = dict[int, list[RoomMessageRow]]()
+        for item in batch:
+            message = item.message
+            if message.sender_id not in usernames:
+                # room was not tracked when usernames were fetched
+                self._message_cache.invalidate_room(message.room_id)
+                continue
+
+            rooms.setdefault(message.room_id, []).append({
+                'id': message.id,
+                'type': message.type,
+                'content': message.content,
+                # sent_at is stored as naive UTC, cached messages have to match ones read from the database
+                'sent_at': message.sent_at.replace(tzinfo=None),
+                'sender_id': message.sender_id,
+                'sender_username': usernames[message.sender_id],
+                'pending': False,
+            })
+
+        for room_id, messages in rooms.items():
+            self._message_cache.append(room_id, messages)
+
+    def _resolve(self, item: _QueuedMessage, error: Error | None) -> None:
+        if not item.outcome.done():
+            item.outcome.set_result(error)
+
+        room_id = item.message.room_id
+        if error is not None:
+            # subscribers already received the message when it was accepted
+            self._broadcast_service.publish(
+                room_channel(room_id),
+                MessageRejectedEvent(message_id=item.message.id, room_id=room_id))
+
+        pending = self._pending_messages.get(room_id)
+        if pending is not None:
+            pending.pop(item, None)
+            if not pending:
+                del self._pending_messages[room_id]
+
+        # failed messages are dropped as well, even if the database was just unavailable, so they are never
+        # stored after their sender and subscribers were told they were not. The log only covers crashes.
+        self._release_logged_message(item)
+
+    def _release_logged_message(self, item: _QueuedMessage) -> None:
+        if self._message_log is not None and item.log_segment is not None:
+            self._message_log.release(item.log_segment)
+            item.log_segment = None
@@ -0,0 +1,51 @@
+import asyncio
+import bcrypt
+import fastapi
+import concurrent.futures
+
+from app.models.errors import ErrorPasswordHashingOverloaded
+
+_RETRY_AFTER_SECONDS = 1
+
+class PasswordService:
+    '''
+    Runs bcrypt hashing and checking in a dedicated worker pool, so expensive password operations
+    never block the event loop. Number of operations waiting for a free worker is limited and
+    requests exceeding that limit are rejected with 503 instead of piling up.
+    '''
+
+    def __init__(self,
+                 salt_rounds: int,
+                 workers: int,
+                 max_queue_size: int) -> None:
+        self._salt_rounds = salt_rounds
+        self._max_pending = workers + max_queue_size
+        self._pending = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='password-hash')
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    async def hash_password(self, password: bytes) -> bytes:
+        return await self._run(self._hash_password, password)
+
+    async def check_password(self, password: bytes, password_hash: bytes) -> bool:
+        return await self._run(bcrypt.checkpw, password, password_hash)
+
+    async def _run(self, func, *args):
+        if self._pending >= self._max_pending:
+            ErrorPasswordHashingOverloaded() \
+                .raise_(fastapi.status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': str(_RETRY_AFTER_SECONDS)})
+
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    def _hash_password(self, password: bytes) -> bytes:
+        return bcrypt.hashpw(
+            password,
+            bcrypt.gensalt(rounds=self._salt_rounds))
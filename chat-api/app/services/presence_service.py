@@ -0,0 +1,125 @@
+import asyncio
+import math
+
+from app.models.user import UserActivityStatus
+from app.services.ephemeral_event_service import EphemeralEventService
+
+class PresenceService:
+    '''
+    Tracks presence of online users in memory and pushes status transitions to their friends.
+    Users go online with their first heartbeat and are expired to offline by a timer wheel once
+    no heartbeat arrives within the timeout, so statuses never have to be recomputed on read.
+    Users which are not tracked are offline.
+    '''
+
+    def __init__(self, ephemeral_event_service: EphemeralEventService, timeout: float, resolution: float) -> None:
+        assert resolution > 0, 'Presence resolution must be positive'
+
+        self._ephemeral_event_service = ephemeral_event_service
+        self._resolution = resolution
+        # users are expired after passing all other slots, the first tick after scheduling can come
+        # right away, so one more slot makes up for it
+        self._wheel = [set[int]() for _ in range(math.ceil(timeout / resolution) + 2)]
+        self._current_slot = 0
+        self._user_slots = dict[int, int]()
+        # statuses chosen by online users
+        self._statuses = dict[int, UserActivityStatus]()
+        self._user_connections = dict[int, int]()
+        self._tick_task: asyncio.Task | None = None
+
+    def get_status(self, user_id: int) -> UserActivityStatus:
+        return self._statuses.get(user_id, UserActivityStatus.OFFLINE)
+
+    def heartbeat(self, user_id: int) -> bool:
+        '''
+        Postpones expiry of an online user. Returns `False` if the user is not tracked, in which case
+        `start_tracking` has to be called with user's stored status.
+        '''
+
+        if user_id not in self._statuses:
+            return False
+
+        self._schedule_expiry(user_id)
+        return True
+
+    def start_tracking(self, user_id: int, status: UserActivityStatus) -> None:
+        '''
+        Brings the user online with the given status, unless they are tracked already.
+        '''
+
+        if not self.heartbeat(user_id):
+            self.set_status(user_id, status)
+
+    def set_status(self, user_id: int, status: UserActivityStatus) -> None:
+        previous_status = self.get_status(user_id)
+        self._statuses[user_id] = status
+        self._schedule_expiry(user_id)
+
+        if status != previous_status:
+            self._ephemeral_event_service.publish_presence(user_id, status)
+
+    def connect_user(self, user_id: int) -> None:
+        '''
+        Registers user's websocket connection. Connected users are never expired.
+        '''
+
+        self._user_connections[user_id] = self._user_connections.get(user_id, 0) + 1
+
+    def disconnect_user(self, user_id: int) -> None:
+        '''
+        Unregisters user's websocket connection. Last closed connection brings the user offline.
+        '''
+
+        connections = self._user_connections.get(user_id, 0) - 1
+        if connections > 0:
+            self._user_connections[user_id] = connections
+            return
+
+        self._user_connections.pop(user_id, None)
+        self._stop_tracking(user_id)
+
+    def start(self) -> None:
+        assert self._tick_task is None, 'Presence expiry task already running'
+        self._tick_task = asyncio.create_task(self._tick_periodically())
+
+    async def shutdown(self) -> None:
+        if self._tick_task is not None:
+            self._tick_task.cancel()
+            await asyncio.gather(self._tick_task, return_exceptions=True)
+            self._tick_task = None
+
+    def _schedule_expiry(self, user_id: int) -> None:
+        slot = self._user_slots.get(user_id)
+        if slot is not None:
+            self._wheel[slot].discard(user_id)
+
+        # the slot right behind the current one is the last to be reached
+        slot = (self._current_slot - 1) % len(self._wheel)
+        self._wheel[slot].add(user_id)
+        self._user_slots[user_id] = slot
+
+    def _stop_tracking(self, user_id: int) -> None:
+        slot = self._user_slots.pop(user_id, None)
+        if slot is not None:
+            self._wheel[slot].discard(user_id)
+
+        status = self._statuses.pop(user_id, None)
+        if status is not None and status != UserActivityStatus.OFFLINE:
+            self._ephemeral_event_service.publish_presence(user_id, UserActivityStatus.OFFLINE)
+
+    def _tick(self) -> None:
+        self._current_slot = (self._current_slot + 1) % len(self._wheel)
+
+        expired = self._wheel[self._current_slot]
+        self._wheel[self._current_slot] = set()
+        for user_id in expired:
+            del self._user_slots[user_id]
+            if user_id in self._user_connections:
+                self._schedule_expiry(user_id)
+            else:
+                self._stop_tracking(user_id)
+
+    async def _tick_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._resolution)
+            self._tick()
@@ -1,23 +1,60 @@
 import enum
+import typing as t
 import sqlalchemy
 import sqlalchemy.exc
 import sqlalchemy.orm
 import fastapi
+from sqlalchemy.dialects import mysql
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
-from app.models.chat_room import APIChatRoom, APIChatRoomUser, RoomType, SQLChatRoom
+from app.cache import TTLCache
+from app.models.chat_room import APIChatRoom, RoomType, SQLChatRoom
 from app.models.chat_room_user import SQLChatRoomUser
-from app.models.user import SQLUser, APIUserForeign
+from app.models.user import SQLUser, APIUserForeign, UserActivityStatus
 from app.models.errors import ErrorRoomAlreadyExists, ErrorRoomAlreadyJoined, ErrorRoomDeleteInternal, ErrorRoomInternalJoin, ErrorRoomNameTooLong, ErrorRoomNotFound, ErrorRoomNotOwner, ErrorRoomPrivateJoin, ErrorRoomInvalidTypeChange, ErrorRoomUserNotJoined
-from app.models.message import RoomMessage, SQLMessage
+from app.models.message import RoomMessageRow, SQLMessage, MessageIncoming, RoomMessageSearchHit
+from app.models.metrics import CacheStats
+from app.services.message_cache import RoomMessageCache
+from app.services.message_service import MessageService
+
+# rows fetched from the server side cursor at once when exporting room history
+_EXPORT_BATCH_SIZE = 1000
+# members of larger rooms are checked in the database instead, to keep cache memory bounded
+_MAX_CACHED_ROOM_MEMBERS = 10000
+_NOT_CACHED = object()
 
 class RoomUsersOrder(enum.StrEnum):
     USERNAME = 'username'
     OWNERSHIP = 'ownership'
     JOIN_DATE = 'join_date'
+    ACTIVITY = 'activity'
 
 class RoomService:
-    def __init__(self, db_sessionmaker: async_sessionmaker[AsyncSession]) -> None:
+    def __init__(self,
+                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 message_cache: RoomMessageCache,
+                 message_service: MessageService,
+                 membership_cache_size: int,
+                 membership_cache_ttl: float) -> None:
         self._db_sessionmaker = db_sessionmaker
+        self._message_cache = message_cache
+        self._message_service = message_service
+        # `None` marks rooms too large to keep their members in memory
+        self._membership_cache = TTLCache[int, set[int] | None](membership_cache_size, membership_cache_ttl)
+        # bumped on every invalidation, so member sets loaded concurrently with a change are not cached
+        self._membership_generation = 0
+
+    def get_membership_cache_stats(self) -> CacheStats:
+        return self._membership_cache.get_stats()
+
+    def invalidate_user(self, user_id: int) -> None:
+        '''
+        Drops cached data related to the user, must be called after user is deleted.
+        '''
+
+        self._membership_cache.invalidate_where(lambda _, members: members is not None and user_id in members)
+        self._membership_generation += 1
+        # messages of deleted user are gone together with them
+        self._message_cache.clear()
 
     async def delete_room(self, room_id: int, user_id: int):
         async with self._db_sessionmaker() as session:
@@ -42,8 +79,21 @@ class RoomService:
             await session.execute(query)
 
             await session.commit()
+
+        self._invalidate_room_members(room_id)
+        self._message_cache.invalidate_room(room_id)
     
-    async def get_room_users(self, room_id: int, offset: int, limit: int):
+    async def get_room_users(self,
+                             room_id: int,
+                             offset: int,
+                             limit: int,
+                             order: RoomUsersOrder = RoomUsersOrder.USERNAME,
+                             status: UserActivityStatus | None = None) -> list[dict[str, t.Any]]:
+        '''
+        Returns `APIChatRoomUser` fields of room users as plain dicts. Only users with the given status
+        are returned if it is provided.
+        '''
+
         async with self._db_sessionmaker() as session:
             query = sqlalchemy.select(
                 SQLChatRoomUser.user_id,
@@ -57,29 +107,149 @@ class RoomService:
                 .join(SQLChatRoom, SQLChatRoom.id == SQLChatRoomUser.room_id) \
                 .join(SQLUser, SQLUser.id == SQLChatRoomUser.user_id) \
                 .where(SQLChatRoomUser.room_id == room_id) \
+                .order_by(*self._get_room_users_order(order), SQLUser.id) \
                 .offset(offset) \
                 .limit(limit)
+            if status is not None:
+                query = query.where(SQLUser.activity_status == status)
+
             return [
-                APIChatRoomUser.model_validate(x)
+                # MySQL returns IF() result as an integer
+                {**x._mapping, 'is_owner': bool(x.is_owner)}
                 for x
                 in await session.execute(query)]
     
-    async def get_last_room_messages(self, room_id: int, offset: int, limit: int):
+    async def get_last_room_messages(self,
+                                     room_id: int,
+                                     limit: int,
+                                     before_id: int | None = None,
+                                     after_id: int | None = None) -> list[RoomMessageRow]:
+        '''
+        Returns room messages ordered from the newest, using message IDs as pagination cursor.
+        Without cursors the newest messages are returned. `before_id` pages towards older messages
+        and `after_id` towards newer ones. Pages reaching the newest stored message are preceded by messages
+        which were accepted but not stored yet, these are marked as pending and don't count towards `limit`.
+        '''
+
+        # snapshot pending messages first, so ones committed in the meantime are returned as stored instead of missing
+        pending = self._message_service.get_pending_messages(room_id) if before_id is None else []
+        if after_id is not None:
+            pending = [x for x in pending if x.id > after_id]
+        messages = await self._get_stored_room_messages(room_id, limit, before_id, after_id)
+
+        if pending and (after_id is None or len(messages) < limit):
+            messages = await self._get_pending_room_messages(pending, messages) + messages
+
+        return messages
+
+    async def _get_stored_room_messages(self,
+                                        room_id: int,
+                                        limit: int,
+                                        before_id: int | None,
+                                        after_id: int | None) -> list[RoomMessageRow]:
+        # first page is by far the most common read and is served from the cache when possible
+        if before_id is None and after_id is None and limit <= self._message_cache.room_size:
+            messages = self._message_cache.get_latest(room_id, limit)
+            if messages is None:
+                messages = await self._load_cached_room_messages(room_id)
+
+            return messages[:limit]
+
         async with self._db_sessionmaker() as session:
-            query = sqlalchemy.select(
-                SQLMessage.id,
-                SQLMessage.type,
-                SQLMessage.content,
-                SQLMessage.sent_at,
-                SQLUser.id.label('sender_id'),
-                SQLUser.username.label('sender_username')) \
-                .join(SQLUser, SQLUser.id == SQLMessage.sender_id) \
-                .where(SQLMessage.room_id == room_id) \
-                .order_by(SQLMessage.sent_at.desc()) \
-                .offset(offset) \
+            query = self._select_room_messages(room_id).limit(limit)
+
+            if before_id is not None:
+                query = query.where(SQLMessage.id < before_id)
+
+            if after_id is not None:
+                # take messages directly following the cursor, not the newest ones
+                query = query.where(SQLMessage.id > after_id).order_by(SQLMessage.id.asc())
+            else:
+                query = query.order_by(SQLMessage.id.desc())
+
+            messages = [
+                _room_message_row(x)
+                for x
+                in (await session.execute(query)).all()]
+
+            if after_id is not None:
+                messages.reverse()
+
+            return messages
+
+    async def _get_pending_room_messages(self,
+                                         pending: list[MessageIncoming],
+                                         stored: list[RoomMessageRow]) -> list[RoomMessageRow]:
+        # message could have been committed after the pending messages were taken
+        stored_ids = {x['id'] for x in stored}
+        pending = [x for x in pending if x.id not in stored_ids]
+
+        # senders of pending messages are usually present on the page already
+        usernames = {x['sender_id']: x['sender_username'] for x in stored}
+        missing_ids = {x.sender_id for x in pending} - usernames.keys()
+        if missing_ids:
+            async with self._db_sessionmaker() as session:
+                query = sqlalchemy.select(SQLUser.id, SQLUser.username) \
+                    .where(SQLUser.id.in_(missing_ids))
+                usernames.update((await session.execute(query)).tuples().all())
+
+        return [
+            {
+                'id': x.id,
+                'type': x.type,
+                'content': x.content,
+                'sent_at': x.sent_at.replace(tzinfo=None),
+                'sender_id': x.sender_id,
+                'sender_username': usernames.get(x.sender_id, ''),
+                'pending': True,
+            }
+            for x
+            in pending]
+
+    async def export_room_messages(self, room_id: int) -> t.AsyncIterator[list[RoomMessageRow]]:
+        '''
+        Yields all stored room messages ordered from the oldest, in batches. Rows are streamed from
+        a server side cursor, so memory usage doesn't depend on the size of room history.
+        '''
+
+        async with self._db_sessionmaker() as session:
+            query = self._select_room_messages(room_id) \
+                .order_by(SQLMessage.id.asc()) \
+                .execution_options(yield_per=_EXPORT_BATCH_SIZE)
+            result = await session.stream(query)
+
+            async for rows in result.partitions():
+                yield [_room_message_row(x) for x in rows]
+
+    async def search_room_messages(self,
+                                   room_id: int,
+                                   search_query: str,
+                                   limit: int,
+                                   cursor_score: float | None = None,
+                                   cursor_id: int | None = None) -> list[RoomMessageSearchHit]:
+        '''
+        Returns room messages matching the query ordered from the most relevant. To get the next page
+        pass score and ID of the last received message as `cursor_score` and `cursor_id`.
+        '''
+
+        score = mysql.match(SQLMessage.content, against=search_query) \
+            .in_natural_language_mode()
+
+        async with self._db_sessionmaker() as session:
+            query = self._select_room_messages(room_id) \
+                .add_columns(score.label('score')) \
+                .where(score > 0) \
+                .order_by(score.desc(), SQLMessage.id.desc()) \
                 .limit(limit)
+
+            if cursor_score is not None and cursor_id is not None:
+                query = query.where(
+                    sqlalchemy.or_(
+                        score < cursor_score,
+                        sqlalchemy.and_(score == cursor_score, SQLMessage.id < cursor_id)))
+
             return [
-                RoomMessage.model_validate(x)
+                RoomMessageSearchHit.model_validate(x)
                 for x
                 in (await session.execute(query)).all()]
 
@@ -89,7 +259,15 @@ class RoomService:
 
         :raises ErrorRoomUserNotJoined: If user doesn't belong to the specified room.
         '''
-        
+
+        members = self._membership_cache.get(room_id, _NOT_CACHED)
+        if members is _NOT_CACHED:
+            members = await self._load_room_members(room_id)
+
+        if members is not None and user_id in members:
+            return
+
+        # cache only confirms membership, as users might have joined through another API instance
         async with self._db_sessionmaker() as session:
             query = sqlalchemy.select(
                 sqlalchemy.exists()
@@ -101,6 +279,9 @@ class RoomService:
                 ErrorRoomUserNotJoined(user_id=user_id, room_id=room_id) \
                     .raise_(fastapi.status.HTTP_404_NOT_FOUND)
 
+        if members is not None:
+            members.add(user_id)
+
     async def update_room(self,
                           room_id: int,
                           user_id: int,
@@ -195,6 +376,8 @@ class RoomService:
             # NOTE If an error happens here the database is in invalid state already.
             await session.commit()
 
+            self._invalidate_room_members(room.id)
+
             return room.id
     
     async def join_room(self, room_id: int, user_id: int):
@@ -227,12 +410,73 @@ class RoomService:
 
                 ErrorRoomAlreadyJoined(room_id=room_id, user_id=user_id) \
                     .raise_(fastapi.status.HTTP_409_CONFLICT)
+
+        self._invalidate_room_members(room_id)
     
+    async def _load_room_members(self, room_id: int) -> set[int] | None:
+        generation = self._membership_generation
+        async with self._db_sessionmaker() as session:
+            query = sqlalchemy.select(SQLChatRoomUser.user_id) \
+                .where(SQLChatRoomUser.room_id == room_id) \
+                .limit(_MAX_CACHED_ROOM_MEMBERS + 1)
+            members = set((await session.scalars(query)).all())
+
+        if len(members) > _MAX_CACHED_ROOM_MEMBERS:
+            members = None
+
+        if generation == self._membership_generation:
+            self._membership_cache.set(room_id, members)
+
+        return members
+
+    def _invalidate_room_members(self, room_id: int) -> None:
+        self._membership_cache.invalidate(room_id)
+        self._membership_generation += 1
+
+    async def _load_cached_room_messages(self, room_id: int) -> list[RoomMessageRow]:
+        generation = self._message_cache.start_load(room_id)
+        messages: list[RoomMessageRow] | None = None
+        try:
+            async with self._db_sessionmaker() as session:
+                query = self._select_room_messages(room_id) \
+                    .order_by(SQLMessage.id.desc()) \
+                    .limit(self._message_cache.room_size)
+                messages = [
+                    _room_message_row(x)
+                    for x
+                    in (await session.execute(query)).all()]
+        finally:
+            self._message_cache.finish_load(room_id, generation, messages)
+
+        return messages
+
+    def _select_room_messages(self, room_id: int) -> sqlalchemy.Select:
+        return sqlalchemy.select(
+            SQLMessage.id,
+            SQLMessage.type,
+            SQLMessage.content,
+            SQLMessage.sent_at,
+            SQLUser.id.label('sender_id'),
+            SQLUser.username.label('sender_username')) \
+            .join(SQLUser, SQLUser.id == SQLMessage.sender_id) \
+            .where(SQLMessage.room_id == room_id)
+
     async def _ensure_room_exists_session(self, room_id: int, session: AsyncSession):
         query = sqlalchemy.select(sqlalchemy.exists().where(SQLChatRoom.id == room_id))
         if not await session.scalar(query):
             self._raise_room_not_found(room_id)
             
+    def _get_room_users_order(self, order: RoomUsersOrder) -> tuple[sqlalchemy.ColumnElement, ...]:
+        match order:
+            case RoomUsersOrder.USERNAME:
+                return (SQLUser.username,)
+            case RoomUsersOrder.OWNERSHIP:
+                return ((SQLChatRoomUser.user_id == SQLChatRoom.owner_id).desc(), SQLUser.username)
+            case RoomUsersOrder.JOIN_DATE:
+                return (SQLChatRoomUser.joined_at,)
+            case RoomUsersOrder.ACTIVITY:
+                return (SQLUser.activity_rank, SQLUser.last_active.desc())
+
     def _raise_room_not_found(self, room_id: int):
         ErrorRoomNotFound(room_id=room_id) \
             .raise_(fastapi.status.HTTP_404_NOT_FOUND)
@@ -250,4 +494,7 @@ class RoomService:
             .select_from(SQLChatRoomUser) \
             .where(SQLChatRoomUser.room_id == room_id) \
             .join(SQLUser, SQLUser.id == SQLChatRoomUser.user_id)
-        return [APIUserForeign.model_validate(x) for x in await session.scalars(query)]
\ No newline at end of file
+        return [APIUserForeign.model_validate(x) for x in await session.scalars(query)]
+
+def _room_message_row(row: sqlalchemy.Row) -> RoomMessageRow:
+    return {**row._mapping, 'pending': False}
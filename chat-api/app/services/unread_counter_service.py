@@ -0,0 +1,177 @@
+import asyncio
+import collections
+import typing as t
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
+from app.models.chat_room_user import SQLChatRoomUser
+from app.models.message import MessageIncoming, SQLMessage
+
+class UnreadCounterService:
+    '''
+    Maintains per membership unread message counters. Committed messages are counted in memory
+    and applied to `chat_room_users` in batches, so unread counts never have to be computed
+    over the whole room history.
+    '''
+
+    def __init__(self, db_engine: AsyncEngine, flush_interval: float) -> None:
+        self._db_engine = db_engine
+        self._flush_interval = flush_interval
+        # committed messages not yet applied to the counters, per room as (message ID, sender ID)
+        self._pending = dict[int, list[tuple[int, int]]]()
+        # ID of the newest message counted in for each room since startup
+        self._last_counted_ids = dict[int, int]()
+        self._flush_task: asyncio.Task | None = None
+
+    def record_messages(self, messages: t.Iterable[MessageIncoming]) -> None:
+        '''
+        Counts in committed messages. Must be called only once messages are stored.
+        '''
+
+        for message in messages:
+            self._pending.setdefault(message.room_id, []).append((message.id, message.sender_id))
+            self._last_counted_ids[message.room_id] = max(
+                message.id,
+                self._last_counted_ids.get(message.room_id, 0))
+
+    def get_pending_unread_count(self, room_id: int, user_id: int, last_read_message_id: int) -> int:
+        '''
+        Returns number of messages unread by the user, which are not yet included in the stored counter.
+        '''
+
+        return sum(
+            1
+            for message_id, sender_id
+            in self._pending.get(room_id, ())
+            if message_id > last_read_message_id and sender_id != user_id)
+
+    def start(self) -> None:
+        assert self._flush_task is None, 'Unread counter flush task already running'
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def shutdown(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+        await self.flush()
+
+    async def flush(self) -> None:
+        pending = self._pending
+        if not pending:
+            return
+
+        self._pending = {}
+        try:
+            async with self._db_engine.begin() as connection:
+                await self._apply_pending(connection, pending)
+        except Exception as e:
+            # any failure (e.g. connection pool timeout) keeps counts for the next flush
+            print(e)
+            self._restore_pending(pending)
+
+    async def mark_read(self, room_id: int, user_id: int, message_id: int) -> None:
+        '''
+        Moves user's read marker forward to the given message and recounts unread messages after it.
+        Markers are never moved backwards.
+        '''
+
+        # counter is recomputed below, so messages counted in so far have to be applied first
+        room_pending = self._pending.pop(room_id, None)
+        pending = {room_id: room_pending} if room_pending is not None else {}
+
+        # messages committed but not counted in yet are applied to the counter on their own later
+        unread_query = sqlalchemy.select(sqlalchemy.func.count()) \
+            .select_from(SQLMessage) \
+            .where(
+                SQLMessage.room_id == room_id,
+                SQLMessage.id > message_id,
+                SQLMessage.sender_id != user_id)
+        last_counted_id = self._last_counted_ids.get(room_id)
+        if last_counted_id is not None:
+            unread_query = unread_query.where(SQLMessage.id <= last_counted_id)
+
+        query = sqlalchemy.update(SQLChatRoomUser) \
+            .where(
+                SQLChatRoomUser.room_id == room_id,
+                SQLChatRoomUser.user_id == user_id,
+                SQLChatRoomUser.last_read_message_id < message_id) \
+            .values(
+                last_read_message_id=message_id,
+                unread_count=unread_query.scalar_subquery())
+
+        try:
+            async with self._db_engine.begin() as connection:
+                await self._apply_pending(connection, pending)
+                await connection.execute(query)
+        except BaseException:
+            self._restore_pending(pending)
+            raise
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    async def _apply_pending(self, connection: AsyncConnection, pending: dict[int, list[tuple[int, int]]]) -> None:
+        if not pending:
+            return
+
+        room_params = list[dict[str, int]]()
+        sender_params = list[dict[str, int]]()
+        for room_id, messages in pending.items():
+            message_ids = [x for x, _ in messages]
+            room_params.append({
+                'b_room_id': room_id,
+                'b_count': len(messages),
+                'b_min_id': min(message_ids),
+                'b_max_id': max(message_ids),
+            })
+
+            for sender_id, count in collections.Counter(x for _, x in messages).items():
+                sender_params.append({
+                    'b_room_id': room_id,
+                    'b_user_id': sender_id,
+                    'b_count': count,
+                    'b_min_id': min(message_ids),
+                })
+
+        # most members have not read any of the counted messages, so they get all of them except their own
+        query = sqlalchemy.update(SQLChatRoomUser) \
+            .where(
+                SQLChatRoomUser.room_id == sqlalchemy.bindparam('b_room_id'),
+                SQLChatRoomUser.last_read_message_id < sqlalchemy.bindparam('b_min_id')) \
+            .values(unread_count=SQLChatRoomUser.unread_count + sqlalchemy.bindparam('b_count'))
+        await connection.execute(query, room_params)
+
+        query = sqlalchemy.update(SQLChatRoomUser) \
+            .where(
+                SQLChatRoomUser.room_id == sqlalchemy.bindparam('b_room_id'),
+                SQLChatRoomUser.user_id == sqlalchemy.bindparam('b_user_id'),
+                SQLChatRoomUser.last_read_message_id < sqlalchemy.bindparam('b_min_id')) \
+            .values(unread_count=SQLChatRoomUser.unread_count - sqlalchemy.bindparam('b_count'))
+        await connection.execute(query, sender_params)
+
+        # members which moved their marker past some of the counted messages in the meantime are
+        # counted exactly, looking only at the range of counted message IDs
+        unread_query = sqlalchemy.select(sqlalchemy.func.count()) \
+            .select_from(SQLMessage) \
+            .where(
+                SQLMessage.room_id == SQLChatRoomUser.room_id,
+                SQLMessage.id > SQLChatRoomUser.last_read_message_id,
+                SQLMessage.id.between(sqlalchemy.bindparam('b_min_id'), sqlalchemy.bindparam('b_max_id')),
+                SQLMessage.sender_id != SQLChatRoomUser.user_id) \
+            .scalar_subquery()
+        query = sqlalchemy.update(SQLChatRoomUser) \
+            .where(
+                SQLChatRoomUser.room_id == sqlalchemy.bindparam('b_room_id'),
+                SQLChatRoomUser.last_read_message_id >= sqlalchemy.bindparam('b_min_id')) \
+            .values(unread_count=SQLChatRoomUser.unread_count + unread_query)
+        await connection.execute(
+            query,
+            [{k: v for k, v in x.items() if k != 'b_count'} for x in room_params])
+
+    def _restore_pending(self, pending: dict[int, list[tuple[int, int]]]) -> None:
+        # counted messages go back in front of the ones recorded in the meantime
+        for room_id, messages in pending.items():
+            self._pending[room_id] = messages + self._pending.get(room_id, [])
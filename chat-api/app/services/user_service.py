@@ -7,20 +7,49 @@ import typing as t
 import sqlalchemy
 import sqlalchemy.orm
 from PIL import Image
+from sqlalchemy.dialects import mysql
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from app.cache import TTLCache
 from app.models.errors import ErrorFriendRequestNotFound, ErrorProfilePictureInvalidType, ErrorProfilePictureSaveFailed, ErrorSelfFriendRequest, ErrorUserNotFoundID
-from app.models.user import APIUserForeign, SQLUser, APIUserSearchResult, UserActivityStatus
+from app.models.user import SQLUser, APIUserForeign, APIUserSelf, APIUserSearchHit, APIUserSearchResult, UserActivityStatus
 from app.models.friend_request import APIFriendRequest, SQLFriendRequest
-from app.models.friend import APIFriend, SQLFriend, APIFriendActivity
-from app.models.chat_room import APIUserChatRoom, SQLChatRoom
+from app.models.friend import SQLFriend, APIFriendActivity
+from app.models.chat_room import SQLChatRoom
 from app.models.chat_room_user import SQLChatRoomUser
+from app.models.metrics import CacheStats
+from app.services.unread_counter_service import UnreadCounterService
+from app.services.presence_service import PresenceService
+
+# max number of users which activity is updated by a single statement
+_ACTIVITY_FLUSH_BATCH_SIZE = 1000
+# max number of stale users brought offline by a single statement, keeps row locks short
+_ACTIVITY_SWEEP_BATCH_SIZE = 1000
+# MySQL's default `ngram_token_size`, shorter search strings can not be matched by the FULLTEXT index
+_USERNAME_NGRAM_SIZE = 2
 
 class UserService:
     def __init__(self,
                  db_session_factory: async_sessionmaker[AsyncSession],
                  data_directory: pathlib.Path,
-                 profile_picture_size: int) -> None:
+                 profile_picture_size: int,
+                 unread_counter_service: UnreadCounterService,
+                 presence_service: PresenceService,
+                 activity_flush_interval: float,
+                 activity_timeout: float,
+                 activity_sweep_interval: float,
+                 profile_cache_size: int,
+                 profile_cache_ttl: float) -> None:
         self._db_session_factory = db_session_factory
+        self._unread_counter_service = unread_counter_service
+        self._presence_service = presence_service
+        self._activity_flush_interval = activity_flush_interval
+        self._activity_timeout = activity_timeout
+        self._activity_sweep_interval = activity_sweep_interval
+        # latest heartbeat time of each user, not yet stored in the database
+        self._pending_activity = dict[int, datetime.datetime]()
+        self._activity_tasks = list[asyncio.Task]()
+        # activity is refreshed without invalidating cached profiles, TTL bounds how stale it gets
+        self._profile_cache = TTLCache[int, APIUserSelf](profile_cache_size, profile_cache_ttl)
         self._profile_pictures_directory = data_directory / 'profile_pictures'
         self._profile_picture_size = profile_picture_size
 
@@ -29,6 +58,27 @@ class UserService:
 
     async def get_user(self, user_id: int) -> SQLUser:
         return await self._get_user_by_id(user_id)
+
+    async def get_user_profile(self, user_id: int) -> APIUserSelf:
+        '''
+        Returns user's profile, read through the profile cache.
+        '''
+
+        profile = self._profile_cache.get(user_id)
+        if profile is None:
+            profile = APIUserSelf.model_validate(await self._get_user_by_id(user_id))
+            self._profile_cache.set(user_id, profile)
+
+        return profile
+
+    async def get_user_foreign_profile(self, user_id: int) -> APIUserForeign:
+        return APIUserForeign.model_validate(await self.get_user_profile(user_id))
+
+    def invalidate_user_profile(self, user_id: int) -> None:
+        self._profile_cache.invalidate(user_id)
+
+    def get_profile_cache_stats(self) -> CacheStats:
+        return self._profile_cache.get_stats()
     
     async def get_user_email_info(self, user_id: int) -> tuple[str, bool]:
         async with self._db_session_factory() as session:
@@ -73,69 +123,100 @@ class UserService:
 
             await session.commit()
     
-    async def get_user_rooms(self, user_id: int) -> list[APIUserChatRoom]:
+    async def get_user_rooms(self, user_id: int) -> list[dict[str, t.Any]]:
+        '''
+        Returns `APIUserChatRoom` fields of rooms the user belongs to as plain dicts.
+        '''
+
         async with self._db_session_factory() as session:
             await self._ensure_user_exists_session(user_id, session)
 
-            query = (
-                sqlalchemy.select(SQLChatRoom)
-                    .select_from(SQLChatRoomUser)
-                    .join(SQLChatRoom, SQLChatRoom.id == SQLChatRoomUser.room_id)
-                    .where(SQLChatRoomUser.user_id == user_id)
-                    .options(sqlalchemy.orm.selectinload(SQLChatRoom.last_message))
-            )
-            
+            query = sqlalchemy.select(
+                SQLChatRoom.id,
+                SQLChatRoom.type,
+                SQLChatRoom.name,
+                SQLChatRoom.last_message_id,
+                SQLChatRoom.last_message_type,
+                SQLChatRoom.last_message_content,
+                SQLChatRoom.last_message_sent_at,
+                SQLChatRoom.last_message_sender_id,
+                SQLUser.username.label('last_message_sender_username'),
+                SQLChatRoomUser.last_read_message_id,
+                SQLChatRoomUser.unread_count) \
+                .select_from(SQLChatRoomUser) \
+                .join(SQLChatRoom, SQLChatRoom.id == SQLChatRoomUser.room_id) \
+                .outerjoin(SQLUser, SQLUser.id == SQLChatRoom.last_message_sender_id) \
+                .where(SQLChatRoomUser.user_id == user_id)
+
             return [
-                APIUserChatRoom.model_validate(x)
+                self._user_chat_room_from_row(user_id, x)
                 for x
-                in await session.scalars(query)]
+                in await session.execute(query)]
     
     async def search_users_by_username(self,
                                        self_id: int,
                                        username: str,
                                        limit: int = 20,
-                                       offset: int = 0) -> APIUserSearchResult:
-        # NOTE Use FULLTEXT index when search becomes slow
+                                       cursor_prefix: bool | None = None,
+                                       cursor_username: str | None = None) -> APIUserSearchResult:
+        '''
+        Searches users which username contains the search string. Users which username starts with it
+        come first, both groups are ordered by username. To get the next page pass `is_prefix_match` and
+        username of the last received user as `cursor_prefix` and `cursor_username`.
+        '''
+
+        users = list[APIUserSearchHit]()
         async with self._db_session_factory() as session:
-            query = sqlalchemy.select(
-                SQLUser.id,
-                SQLUser.username,
-                SQLUser.activity_status,
-                SQLUser.last_active,
-                SQLUser.created_at) \
-                .where(
-                    sqlalchemy.and_(
-                        SQLUser.username.ilike(f'%{username}%'),
-                        SQLUser.id != self_id)) \
-                .order_by(SQLUser.username) \
-                .limit(limit) \
-                .offset(offset)
-            results = (await session.execute(query)).all()
-
-            return APIUserSearchResult(
-                query=username,
-                offset=offset,
-                limit=limit,
-                users=[APIUserForeign.model_validate(x) for x in results])
+            # prefix matches are read in order straight from the username index
+            if cursor_prefix is None or cursor_prefix:
+                query = self._select_search_users(self_id, cursor_username if cursor_prefix else None) \
+                    .where(SQLUser.username.startswith(username, autoescape=True)) \
+                    .limit(limit)
+                users.extend(
+                    APIUserSearchHit(**x, is_prefix_match=True)
+                    for x
+                    in (await session.execute(query)).mappings())
+
+            # phrase search over ngrams matches usernames containing the whole search string
+            phrase = username.replace('"', '')
+            if len(users) < limit and len(phrase) >= _USERNAME_NGRAM_SIZE:
+                query = self._select_search_users(self_id, cursor_username if cursor_prefix is False else None) \
+                    .where(
+                        mysql.match(SQLUser.username, against=f'"{phrase}"').in_boolean_mode(),
+                        sqlalchemy.not_(SQLUser.username.startswith(username, autoescape=True))) \
+                    .limit(limit - len(users))
+                users.extend(
+                    APIUserSearchHit(**x, is_prefix_match=False)
+                    for x
+                    in (await session.execute(query)).mappings())
+
+        return APIUserSearchResult(
+            query=username,
+            limit=limit,
+            users=users)
     
     async def get_user_friends_activity(self, user_id: int) -> list[APIFriendActivity]:
-        async with self._db_session_factory() as session:
-            query = sqlalchemy.select(
-                SQLUser.id,
-                SQLUser.activity_status,
-                sqlalchemy.literal_column('1', sqlalchemy.Boolean).label('user_exists')) \
-                .select_from(SQLUser) \
-                .outerjoin(SQLFriend, SQLFriend.friend_id == SQLUser.id) \
-                .outerjoin(SQLUser.__table__.alias('f'), SQLFriend.friend_id == sqlalchemy.literal_column('f.id')) \
-                .where(SQLUser.id == user_id)
-            
-            rows = (await session.execute(query)).all()
-            if not rows:
-                self._raise_user_not_found(user_id)
+        '''
+        Returns current statuses of user's friends as tracked by the presence service.
+        '''
 
-            return [APIFriendActivity.model_validate(x) for x in rows]
+        return [
+            APIFriendActivity(id=x, activity_status=self._presence_service.get_status(x))
+            for x
+            in await self.get_user_friend_ids(user_id)]
         
-    async def get_user_friends(self, user_id: int) -> list[APIFriend]:
+    async def get_user_friend_ids(self, user_id: int) -> list[int]:
+        async with self._db_session_factory() as session:
+            query = sqlalchemy.select(SQLFriend.friend_id) \
+                .where(SQLFriend.user_id == user_id)
+            return list((await session.scalars(query)).all())
+
+    async def get_user_friends(self, user_id: int, status: UserActivityStatus | None = None) -> list[dict[str, t.Any]]:
+        '''
+        Returns `APIFriend` fields of user's friends as plain dicts, ordered by activity status and
+        most recently active first. Only friends with the given status are returned if it is provided.
+        '''
+
         async with self._db_session_factory() as session:
             self._ensure_user_exists_session(user_id, session)
 
@@ -146,10 +227,11 @@ class UserService:
                 SQLUser.activity_status) \
                 .join(SQLFriend, SQLFriend.friend_id == SQLUser.id) \
                 .where(SQLFriend.user_id == user_id) \
-                .order_by(SQLUser.activity_status)
-            results = (await session.execute(query)).all()
+                .order_by(SQLUser.activity_rank, SQLUser.last_active.desc())
+            if status is not None:
+                query = query.where(SQLUser.activity_status == status)
 
-            return [APIFriend.model_validate(x) for x in results]
+            return [dict(x) for x in (await session.execute(query)).mappings()]
     
     async def get_user_profile_picture(self, user_id: int) -> bytes | None:
         await self._ensure_user_exists(user_id)
@@ -163,6 +245,7 @@ class UserService:
     def delete_user_profile_picture(self, user_id: int) -> None:
         self._ensure_user_exists(user_id)
         self._delete_user_profile_picture(user_id)
+        self.invalidate_user_profile(user_id)
     
     async def change_user_activity_status(self,
                                           user_id: int,
@@ -171,21 +254,110 @@ class UserService:
         async with self._db_session_factory(expire_on_commit=False) as session:
             user = await self._get_user_by_id_session(user_id, session)
             user.user_activity_status = status
+            user.activity_status = status
             user.last_active = now
             
             await session.flush()
             await session.refresh(user)
 
             await session.commit()
+
+            self.invalidate_user_profile(user_id)
+            self._presence_service.set_status(user_id, status)
             
             return (user.activity_status, user.last_active)
         
     async def refresh_user_activity(self, user_id: int, now: datetime.datetime) -> None:
-        async with self._db_session_factory() as session:
-            user = await self._get_user_by_id_session(user_id, session)
-            user.last_active = now
+        '''
+        Records user's heartbeat. Heartbeats are coalesced in memory and stored periodically,
+        which is precise enough as activity status only changes after minutes of inactivity.
+        '''
 
-            await session.commit()
+        self._pending_activity[user_id] = max(now, self._pending_activity.get(user_id, now))
+
+        if not self._presence_service.heartbeat(user_id):
+            # stored status is loaded once per presence session, when the user comes online
+            query = sqlalchemy.select(SQLUser.user_activity_status).where(SQLUser.id == user_id)
+            async with self._db_session_factory() as session:
+                status = await session.scalar(query)
+
+            if status is not None:
+                self._presence_service.start_tracking(user_id, status)
+
+    def start_activity_tasks(self) -> None:
+        assert not self._activity_tasks, 'User activity tasks already running'
+        self._activity_tasks = [
+            asyncio.create_task(self._flush_activity_periodically()),
+            asyncio.create_task(self._sweep_activity_periodically()),
+        ]
+
+    async def shutdown_activity_tasks(self) -> None:
+        for task in self._activity_tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._activity_tasks, return_exceptions=True)
+        self._activity_tasks = []
+
+        await self.flush_activity()
+
+    async def flush_activity(self) -> None:
+        pending = self._pending_activity
+        if not pending:
+            return
+
+        self._pending_activity = {}
+        items = list(pending.items())
+        try:
+            async with self._db_session_factory() as session:
+                for i in range(0, len(items), _ACTIVITY_FLUSH_BATCH_SIZE):
+                    batch = dict(items[i:i + _ACTIVITY_FLUSH_BATCH_SIZE])
+                    # activity can be stored in the meantime by other means (e.g. status change),
+                    # so it is never moved backwards
+                    query = sqlalchemy.update(SQLUser) \
+                        .where(SQLUser.id.in_(batch.keys())) \
+                        .values(
+                            last_active=sqlalchemy.func.greatest(
+                                SQLUser.last_active,
+                                sqlalchemy.case(batch, value=SQLUser.id)),
+                            # brings users swept as stale back online
+                            activity_status=SQLUser.user_activity_status) \
+                        .execution_options(synchronize_session=False)
+                    await session.execute(query)
+
+                await session.commit()
+        except Exception as e:
+            # any failure (e.g. connection pool timeout) keeps heartbeats for the next flush
+            print(e)
+            # heartbeats recorded in the meantime are newer
+            for user_id, last_active in pending.items():
+                self._pending_activity.setdefault(user_id, last_active)
+
+    async def sweep_activity(self) -> None:
+        '''
+        Brings users without heartbeat within the activity timeout offline, in batches.
+        '''
+
+        query = sqlalchemy.update(SQLUser) \
+            .where(
+                SQLUser.activity_status.in_([x for x in UserActivityStatus if x != UserActivityStatus.OFFLINE]),
+                SQLUser.last_active < sqlalchemy.func.date_sub(
+                    sqlalchemy.func.now(),
+                    sqlalchemy.text(f'INTERVAL {int(self._activity_timeout)} SECOND'))) \
+            .values(activity_status=UserActivityStatus.OFFLINE) \
+            .with_dialect_options(mysql_limit=_ACTIVITY_SWEEP_BATCH_SIZE) \
+            .execution_options(synchronize_session=False)
+
+        try:
+            while True:
+                async with self._db_session_factory() as session:
+                    result = await session.execute(query)
+                    await session.commit()
+
+                if result.rowcount < _ACTIVITY_SWEEP_BATCH_SIZE:
+                    break
+        except Exception as e:
+            # the sweep is simply retried on the next run, failure must not stop the periodic task
+            print(e)
         
     async def change_user_profile_picture(self, user_id: int, image_file: fastapi.UploadFile) -> None:
         await self._ensure_user_exists(user_id)
@@ -210,6 +382,9 @@ class UserService:
         except Exception:
             ErrorProfilePictureSaveFailed() \
                 .raise_(fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            # old picture is removed even if the new one could not be saved
+            self.invalidate_user_profile(user_id)
     
     async def get_user_friend_requests(self, user_id: int) -> list[APIFriendRequest]:
         async with self._db_session_factory() as session:
@@ -227,6 +402,58 @@ class UserService:
             results = await session.execute(query)
             return [APIFriendRequest.model_validate(x) for x in results.all()]
     
+    def _user_chat_room_from_row(self, user_id: int, row: sqlalchemy.Row) -> dict[str, t.Any]:
+        last_message = None
+        # sender username is missing if the sender was deleted together with their messages
+        if row.last_message_id is not None and row.last_message_sender_username is not None:
+            last_message = {
+                'id': row.last_message_id,
+                'type': row.last_message_type,
+                'content': row.last_message_content,
+                'sent_at': row.last_message_sent_at,
+                'sender_id': row.last_message_sender_id,
+                'sender_username': row.last_message_sender_username,
+                'pending': False,
+            }
+
+        return {
+            'id': row.id,
+            'type': row.type,
+            'name': row.name,
+            'last_message': last_message,
+            'last_read_message_id': row.last_read_message_id,
+            # stored counter lags behind by messages committed since the last flush
+            'unread_count': row.unread_count + self._unread_counter_service.get_pending_unread_count(
+                row.id,
+                user_id,
+                row.last_read_message_id),
+        }
+
+    async def _flush_activity_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._activity_flush_interval)
+            await self.flush_activity()
+
+    async def _sweep_activity_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._activity_sweep_interval)
+            await self.sweep_activity()
+
+    def _select_search_users(self, self_id: int, cursor_username: str | None) -> sqlalchemy.Select:
+        query = sqlalchemy.select(
+            SQLUser.id,
+            SQLUser.username,
+            SQLUser.accepts_friend_requests,
+            SQLUser.activity_status,
+            SQLUser.last_active,
+            SQLUser.created_at) \
+            .where(SQLUser.id != self_id) \
+            .order_by(SQLUser.username)
+        if cursor_username is not None:
+            query = query.where(SQLUser.username > cursor_username)
+
+        return query
+
     async def _ensure_user_exists_session(self, user_id: int, session: AsyncSession) -> None:
         query = sqlalchemy.select(sqlalchemy.exists().where(SQLUser.id == user_id))
         if not await session.scalar(query):
@@ -0,0 +1,94 @@
+import bisect
+import typing as t
+import sqlalchemy
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from app.cache import TTLCache
+from app.models.metrics import CacheStats
+from app.models.user import SQLUser
+
+# max number of matches returned for a single prefix
+_MAX_MATCHES = 20
+# longer prefixes match few users and are cheap to look up, so they are not cached
+_MAX_CACHED_PREFIX_LENGTH = 3
+
+class UsernameAutocompleteService:
+    '''
+    Keeps all usernames sorted in memory, so prefix matches are found with a binary search instead of
+    a database query. Matches of short prefixes, which are requested the most, are cached.
+    Usernames are matched case insensitively.
+    '''
+
+    def __init__(self,
+                 db_sessionmaker: async_sessionmaker[AsyncSession],
+                 cache_size: int,
+                 cache_ttl: float) -> None:
+        self._db_sessionmaker = db_sessionmaker
+        # (case folded username, user ID) pairs in sorted order
+        self._keys = list[tuple[str, int]]()
+        self._usernames = dict[int, str]()
+        self._cache = TTLCache[str, list[dict[str, t.Any]]](cache_size, cache_ttl)
+
+    def get_cache_stats(self) -> CacheStats:
+        return self._cache.get_stats()
+
+    async def load(self) -> None:
+        async with self._db_sessionmaker() as session:
+            rows = (await session.execute(sqlalchemy.select(SQLUser.id, SQLUser.username))).all()
+
+        self._usernames = {x.id: x.username for x in rows}
+        self._keys = sorted((x.username.casefold(), x.id) for x in rows)
+        self._cache.clear()
+
+    def get_matches(self, prefix: str, limit: int, exclude_id: int | None = None) -> list[dict[str, t.Any]]:
+        '''
+        Returns `APIUsernameMatch` fields of users which username starts with the prefix, ordered by username.
+        '''
+
+        limit = min(limit, _MAX_MATCHES)
+        prefix = prefix.casefold()
+
+        matches = None
+        if len(prefix) <= _MAX_CACHED_PREFIX_LENGTH:
+            matches = self._cache.get(prefix)
+
+        if matches is None:
+            # one more match makes up for the excluded user
+            matches = self._find_matches(prefix, _MAX_MATCHES + 1)
+            if len(prefix) <= _MAX_CACHED_PREFIX_LENGTH:
+                self._cache.set(prefix, matches)
+
+        return [x for x in matches if x['id'] != exclude_id][:limit]
+
+    def add_user(self, user_id: int, username: str) -> None:
+        self._usernames[user_id] = username
+        bisect.insort(self._keys, (username.casefold(), user_id))
+        self._invalidate_prefixes(username)
+
+    def remove_user(self, user_id: int) -> None:
+        username = self._usernames.pop(user_id, None)
+        if username is None:
+            return
+
+        key = (username.casefold(), user_id)
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+        self._invalidate_prefixes(username)
+
+    def _find_matches(self, prefix: str, limit: int) -> list[dict[str, t.Any]]:
+        matches = list[dict[str, t.Any]]()
+        for i in range(bisect.bisect_left(self._keys, (prefix,)), len(self._keys)):
+            key, user_id = self._keys[i]
+            if not key.startswith(prefix) or len(matches) == limit:
+                break
+
+            matches.append({'id': user_id, 'username': self._usernames[user_id]})
+
+        return matches
+
+    def _invalidate_prefixes(self, username: str) -> None:
+        key = username.casefold()
+        for length in range(min(len(key), _MAX_CACHED_PREFIX_LENGTH) + 1):
+            self._cache.invalidate(key[:length])
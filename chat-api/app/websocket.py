@@ -0,0 +1,61 @@
+import json
+import asyncio
+import typing as t
+import fastapi
+
+from app.services.broadcast_service import Subscription
+from app.services.auth_service import AuthorizationService
+
+async def authenticate(websocket: fastapi.WebSocket, auth_service: AuthorizationService) -> int:
+    '''
+    Validates credentials of websocket handshake and returns ID of the user. Browsers cannot set headers
+    on websocket handshake, so user JWT is passed in `token` query parameter and API key either
+    in `X-Api-Key` header or `api_key` query parameter.
+
+    :raises fastapi.HTTPException: If API key or JWT is not valid.
+    '''
+
+    await auth_service.validate_api_key(
+        websocket.headers.get('x-api-key') or websocket.query_params.get('api_key', ''))
+    return auth_service.decode_jwt(websocket.query_params.get('token', ''))
+
+async def serve_subscription(websocket: fastapi.WebSocket,
+                             subscription: Subscription,
+                             on_client_message: t.Callable[[str], t.Awaitable[None]] | None = None) -> None:
+    '''
+    Forwards subscription events to an accepted websocket until either side goes away.
+    Messages sent by the client are passed to `on_client_message` (or ignored if not provided).
+    '''
+
+    receiver = asyncio.create_task(_receive_client_messages(websocket, on_client_message))
+    sender = asyncio.create_task(_send_events(websocket, subscription))
+
+    done, pending = await asyncio.wait((receiver, sender), return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        # retrieve exceptions (mostly disconnects) so they don't get reported as unhandled
+        task.exception()
+
+    if subscription.dropped:
+        await websocket.close(fastapi.status.WS_1013_TRY_AGAIN_LATER, reason='slow_consumer')
+
+async def close_with_error(websocket: fastapi.WebSocket, exc: fastapi.HTTPException) -> None:
+    # error details are raised either as dicts or already serialized JSON
+    detail = json.loads(exc.detail) if isinstance(exc.detail, str) else exc.detail
+    await websocket.close(
+        fastapi.status.WS_1008_POLICY_VIOLATION,
+        reason=detail.get('error_code', ''))
+
+async def _receive_client_messages(websocket: fastapi.WebSocket,
+                                   on_client_message: t.Callable[[str], t.Awaitable[None]] | None) -> None:
+    while True:
+        message = await websocket.receive_text()
+        if on_client_message is not None:
+            await on_client_message(message)
+
+async def _send_events(websocket: fastapi.WebSocket, subscription: Subscription) -> None:
+    while (data := await subscription.receive()) is not None:
+        await websocket.send_text(data)
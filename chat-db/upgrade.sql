@@ -0,0 +1,54 @@
+-- Schema changes for databases created by an earlier version of the API. Tables are created by the API on
+-- startup, but existing tables are never altered. Apply sections newer than the deployed version in order,
+-- with the API stopped.
+
+-- ----- Keyset pagination of room history -----
+CREATE INDEX ix_messages_room_id_id ON messages (room_id, id);
+
+-- ----- Message IDs generated by the API -----
+-- existing IDs are far below generated ones, so history order is kept
+ALTER TABLE messages MODIFY id BIGINT NOT NULL;
+
+-- ----- Last message preview on chat rooms -----
+ALTER TABLE chat_rooms
+    ADD COLUMN last_message_id BIGINT NULL,
+    ADD COLUMN last_message_type ENUM('TEXT','IMAGE','FILE') NULL,
+    ADD COLUMN last_message_content VARCHAR(256) NULL,
+    ADD COLUMN last_message_sent_at DATETIME NULL,
+    ADD COLUMN last_message_sender_id BIGINT NULL;
+UPDATE chat_rooms r
+    JOIN (SELECT room_id, MAX(id) AS id FROM messages GROUP BY room_id) latest ON latest.room_id = r.id
+    JOIN messages m ON m.id = latest.id
+    SET r.last_message_id = m.id,
+        r.last_message_type = m.type,
+        r.last_message_content = m.content,
+        r.last_message_sent_at = m.sent_at,
+        r.last_message_sender_id = m.sender_id;
+
+-- ----- Unread counters and read markers -----
+ALTER TABLE chat_room_users
+    ADD COLUMN last_read_message_id BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN unread_count INTEGER NOT NULL DEFAULT 0;
+-- history stored so far is treated as read, counters start at zero
+UPDATE chat_room_users cru
+    JOIN (SELECT room_id, MAX(id) AS id FROM messages GROUP BY room_id) latest ON latest.room_id = cru.room_id
+    SET cru.last_read_message_id = latest.id;
+
+-- ----- Room message search -----
+-- the server must run with innodb_ft_enable_stopword=OFF (see docker-compose.yml) before the index is built,
+-- otherwise every ngram containing a stopword is left out. An index built without it has to be dropped and added again.
+ALTER TABLE messages ADD FULLTEXT INDEX ix_messages_content_fulltext (content) WITH PARSER ngram;
+
+-- ----- Stored effective activity status -----
+ALTER TABLE users
+    ADD COLUMN activity_status ENUM('ACTIVE','OFFLINE','BRB','DONT_DISTURB') NOT NULL DEFAULT 'OFFLINE',
+    ADD COLUMN activity_rank SMALLINT GENERATED ALWAYS AS (FIELD(activity_status, 'ACTIVE', 'BRB', 'DONT_DISTURB', 'OFFLINE')) STORED NOT NULL;
+UPDATE users
+    SET activity_status = IF(last_active < NOW() - INTERVAL 3 MINUTE, 'OFFLINE', user_activity_status);
+CREATE INDEX ix_users_activity_status_last_active ON users (activity_status, last_active);
+CREATE INDEX ix_users_activity_rank_last_active ON users (activity_rank, last_active DESC);
+
+-- ----- Username search -----
+-- the server must run with innodb_ft_enable_stopword=OFF (see docker-compose.yml) before the index is built,
+-- otherwise every ngram containing a stopword is left out. An index built without it has to be dropped and added again.
+ALTER TABLE users ADD FULLTEXT INDEX ix_users_username_fulltext (username) WITH PARSER ngram;